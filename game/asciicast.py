@@ -0,0 +1,179 @@
+import dataclasses
+import enum
+import gzip
+import json
+import os
+import queue
+import threading
+import time
+from typing import IO, List, Optional, Tuple
+
+ASCIICAST_VERSION = 2
+# Frames waiting for the writer thread
+MAX_QUEUED_FRAMES = 256
+# Most output COALESCE holds back while the queue is full, past this the game waits like BLOCK
+MAX_COALESCED_CHARS = 1 << 20
+# Game thread time recording a frame is meant to take
+FRAME_BUDGET = 0.0005
+
+# A frame is the seconds since the recording started and everything written during it
+_Frame = Tuple[float, str]
+
+
+class Backpressure(enum.Enum):
+    """What recording does with a frame when the writer thread is behind and the queue is full"""
+
+    BLOCK = 'block'  # Wait for room, the game slows down to the pace of the disk
+    DROP = 'drop'  # Leave the frame out, playback shows stale cells until they are drawn again
+    COALESCE = 'coalesce'  # Send the output along with the next frame that fits, only its timing is lost
+
+
+@dataclasses.dataclass
+class AsciicastStats(object):
+    """Counters of an asciicast recording"""
+
+    frames: int = 0  # Frames the game handed over
+    events: int = 0  # Output events written to the file
+    dropped: int = 0
+    coalesced: int = 0  # Frames held back and sent along with a later one
+    blocked: int = 0  # Frames the game had to wait for the writer on
+    over_budget: int = 0  # Frames that took longer than FRAME_BUDGET to record
+    record_time: float = 0.0  # Game thread time spent recording
+    write_time: float = 0.0  # Writer thread time spent encoding and compressing
+    chars_written: int = 0
+
+    @property
+    def overhead_per_frame(self) -> float:
+        """Return the average game thread time spent recording a frame"""
+        return self.record_time / self.frames if self.frames else 0.0
+
+
+class AsciicastRecorder(object):
+    """
+    Records the output of a game to a gzip compressed asciicast v2 file, which asciinema can play back.
+
+    The game hands over everything it wrote during a frame, FrameCapture collects it, and the frame is timestamped
+    and put on a bounded queue. A writer thread encodes the frames as output events and compresses them, so the game
+    thread never waits for the disk unless the policy is BLOCK. What happens to frames while the queue is full is
+    up to the backpressure policy.
+    """
+
+    def __init__(self, path: str, width: int = 80, height: int = 24, policy: Backpressure = Backpressure.COALESCE,
+                 max_frames: int = MAX_QUEUED_FRAMES, title: Optional[str] = None):
+        self.path = path
+        self.width = width
+        self.height = height
+        self.policy = policy
+        self.title = title
+        self.stats = AsciicastStats()
+        self.error: Optional[OSError] = None  # Set by the writer thread if the file could not be written
+        self._queue: 'queue.Queue[Optional[_Frame]]' = queue.Queue(max_frames)
+        self._pending: List[str] = []  # Output held back by COALESCE
+        self._start = 0.0
+        self._file: Optional[IO[str]] = None
+        self._thread: Optional[threading.Thread] = None
+
+    def __enter__(self) -> 'AsciicastRecorder':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """
+        Write the header and start the writer thread.
+
+        :return: None
+        """
+        header = {
+            'version': ASCIICAST_VERSION,
+            'width': self.width,
+            'height': self.height,
+            'timestamp': int(time.time()),
+            'env': {'TERM': os.environ.get('TERM', 'xterm-256color')},
+        }
+        if self.title is not None:
+            header['title'] = self.title
+        self._file = gzip.open(self.path, 'wt', encoding='utf-8')
+        self._file.write(json.dumps(header) + '\n')
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(target=self._run, name='asciicast', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        """
+        Write the frames still queued or held back and close the file.
+
+        :return: None
+        """
+        if self._thread is None:
+            return
+        if self._pending:
+            self._put(self._take_pending(time.perf_counter() - self._start))
+        self._queue.put(None)
+        self._thread.join()
+        self._thread = None
+        self._file.close()
+
+    def record(self, output: str) -> None:
+        """
+        Record the output of a frame.
+
+        :param output: Everything the game wrote during the frame
+        :return: None
+        """
+        start = time.perf_counter()
+        self.stats.frames += 1
+        if output:
+            self._pending.append(output)
+            frame = self._take_pending(start - self._start)
+            if self.policy is Backpressure.BLOCK:
+                self._put(frame)
+            else:
+                try:
+                    self._queue.put_nowait(frame)
+                except queue.Full:
+                    if self.policy is Backpressure.DROP:
+                        self.stats.dropped += 1
+                    elif len(frame[1]) < MAX_COALESCED_CHARS:
+                        self._pending.append(frame[1])
+                        self.stats.coalesced += 1
+                    else:
+                        self._put(frame)
+
+        elapsed = time.perf_counter() - start
+        self.stats.record_time += elapsed
+        if elapsed > FRAME_BUDGET:
+            self.stats.over_budget += 1
+
+    def _take_pending(self, timestamp: float) -> _Frame:
+        output = ''.join(self._pending)
+        self._pending.clear()
+        return timestamp, output
+
+    def _put(self, frame: _Frame) -> None:
+        if self._queue.full():
+            self.stats.blocked += 1
+        self._queue.put(frame)
+
+    def _run(self) -> None:
+        while True:
+            frame = self._queue.get()
+            if frame is None:
+                break
+            if self.error is not None:
+                # Keep draining, so the game doesn't block on a recording that can't be written anyway
+                continue
+            start = time.perf_counter()
+            try:
+                self._write_event(frame)
+            except OSError as error:
+                self.error = error
+            self.stats.write_time += time.perf_counter() - start
+
+    def _write_event(self, frame: _Frame) -> None:
+        timestamp, output = frame
+        self._file.write(json.dumps([round(timestamp, 6), 'o', output]) + '\n')
+        self.stats.events += 1
+        self.stats.chars_written += len(output)
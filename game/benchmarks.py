@@ -0,0 +1,370 @@
+import argparse
+import json
+import os
+import random
+import statistics
+import tempfile
+import time
+import timeit
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional, Tuple
+
+from game.asciicast import FRAME_BUDGET, AsciicastRecorder, Backpressure
+from game.components import (
+    Ascii, FollowAI, Text, TimeToLive, Transform, Vision
+)
+from game.cutscenes import ordered_cutscenes
+from game.ecs.world import World
+from game.footprint import WallGrid, footprint
+from game.fov import compute_fov
+from game.layout import layout_cache
+from game.mapgeneration import MapType, mapgenerator
+from game.minimap import GLYPHS, Minimap
+from game.prefabs import ENEMY, PLAYER
+from game.processors import (
+    AILevelOfDetail, ascii_renderer, enemy_movement, fov_processor,
+    text_renderer, ttl_processor
+)
+from game.recording import headless_terminal
+from game.spectate import FrameCapture
+from game.state import LEVEL_PARAMETERS, GameLevel
+from game.utils import Vector2, output_to
+
+# A benchmark takes the parsed command line and returns its measurements
+Benchmark = Callable[[argparse.Namespace], Dict[str, object]]
+
+
+def _best_of(func: Callable[[], object], repeat: int) -> float:
+    return min(timeit.repeat(func, number=1, repeat=repeat))
+
+
+def bench_spawn(args: argparse.Namespace) -> Dict[str, object]:
+    """Spawning a wave of enemies with spawn_batch against a loop over create_entity"""
+    count = args.count
+    target = Transform(position=Vector2(10, 10))
+
+    def create_loop() -> None:
+        world = World()
+        for i in range(count):
+            world.create_entity(*ENEMY.instantiate({
+                Transform: {'position': Vector2(i, 0)},
+                FollowAI: {'follow_transform': target},
+            }))
+
+    def batch_shared() -> None:
+        World().spawn_batch(ENEMY, count, overrides={FollowAI: {'follow_transform': target}})
+
+    def batch_per_entity() -> None:
+        World().spawn_batch(ENEMY, count, overrides=[
+            {Transform: {'position': Vector2(i, 0)}, FollowAI: {'follow_transform': target}}
+            for i in range(count)
+        ])
+
+    loop = _best_of(create_loop, args.repeat)
+    shared = _best_of(batch_shared, args.repeat)
+    per_entity = _best_of(batch_per_entity, args.repeat)
+    return {
+        'entities': count,
+        'create_entity_loop': loop,
+        'spawn_batch_shared': shared,
+        'spawn_batch_per_entity': per_entity,
+        'speedup_shared': loop / shared,
+        'speedup_per_entity': loop / per_entity,
+    }
+
+
+def bench_schedule(args: argparse.Namespace) -> Dict[str, object]:
+    """Per-stage wall time of a mixed world ticked serially and on a thread pool"""
+    level_map, spawn = mapgenerator(**LEVEL_PARAMETERS)
+    term = headless_terminal()
+    results: Dict[str, object] = {}
+
+    for mode, executor in (('serial', None), ('threaded', ThreadPoolExecutor(os.cpu_count()))):
+        world = World(executor=executor)
+        player, = world.spawn_batch(PLAYER, 1, overrides={Transform: {'position': Vector2(spawn, 0)}})
+        world.spawn_batch(ENEMY, args.count, overrides={
+            FollowAI: {'follow_transform': world.get_component(player, Transform)},
+        })
+        for _ in range(100):
+            world.create_entity(Text(text_string='Dedicated Dugongs'), TimeToLive(expires_after=1e9))
+        # Enemy AI, timers and text drawing touch disjoint components and share a stage
+        world.register_processor(enemy_movement(level_map))
+        world.register_processor(ttl_processor)
+        world.register_processor(text_renderer)
+
+        reports = []
+        with output_to(term.stream):
+            for _ in range(args.repeat * 10):
+                world.tick(term, 0.1, '')
+                reports.append(world.schedule_report())
+        if executor is not None:
+            executor.shutdown()
+
+        results[mode] = {
+            'stages': [stage['processors'] for stage in reports[-1]['stages']],
+            'stage_times': [
+                statistics.median(report['stages'][idx]['wall_time'] for report in reports)
+                for idx in range(len(reports[-1]['stages']))
+            ],
+            'serial_time': statistics.median(report['serial_time'] for report in reports),
+            'scheduled_time': statistics.median(report['scheduled_time'] for report in reports),
+        }
+    term.stream.close()
+    return results
+
+
+def bench_ai_lod(args: argparse.Namespace) -> Dict[str, object]:
+    """Enemy AI cost per tick with level-of-detail against updating every enemy on the same cadence"""
+    width, height = 100, 2000
+    level_map = [[' '] * width for _ in range(height)]
+    rng = random.Random(0)
+    results: Dict[str, object] = {}
+
+    # A radius covering the whole map puts every enemy in the near bucket, like the AI without level-of-detail
+    for mode, lod in (('full', AILevelOfDetail(near_radius=height)), ('lod', AILevelOfDetail())):
+        world = World()
+        player, = world.spawn_batch(PLAYER, 1, overrides={Transform: {'position': Vector2(width // 2, 0)}})
+        world.spawn_batch(ENEMY, args.count, overrides=[
+            {
+                Transform: {'position': Vector2(rng.randrange(width), rng.randrange(height))},
+                FollowAI: {'follow_transform': world.get_component(player, Transform)},
+            }
+            for _ in range(args.count)
+        ])
+        processor = enemy_movement(level_map, lod)
+        ticks = 100
+
+        def run() -> None:
+            for _ in range(ticks):
+                processor(None, world, 0.1, '')
+
+        results[mode] = {
+            'per_tick': _best_of(run, args.repeat) / ticks,
+            'buckets': {k: v for k, v in processor.lod_stats.items() if k in ('near', 'mid', 'far')},
+        }
+    results['speedup'] = results['full']['per_tick'] / results['lod']['per_tick']
+    return results
+
+
+def bench_fov(args: argparse.Namespace) -> Dict[str, object]:
+    """Field of view kept up to date by fov_processor against shadowcasting the whole map every tick"""
+    width, height = 200, 2000
+    rng = random.Random(0)
+    level_map = [['#' if rng.random() < 0.05 else ' ' for _ in range(width)] for _ in range(height)]
+    ticks = 200
+    # The player walks down the map, stopping every other tick
+    path = [Vector2(width // 2, tick // 2) for tick in range(ticks)]
+    for position in path:
+        level_map[position.y][position.x] = ' '
+
+    world = World()
+    player, = world.spawn_batch(PLAYER, 1)
+    transform = world.get_component(player, Transform)
+    processor = fov_processor(level_map)
+
+    def incremental() -> None:
+        world.get_component(player, Vision).origin = None
+        for position in path:
+            transform.position = position
+            processor(None, world, 0.1, '')
+
+    def full() -> None:
+        for position in path:
+            compute_fov(level_map, position.x, position.y, max(width, height))
+
+    incremental_time = _best_of(incremental, args.repeat)
+    full_time = _best_of(full, args.repeat)
+    return {
+        'map': [width, height],
+        'radius': world.get_component(player, Vision).radius,
+        'full_per_tick': full_time / ticks,
+        'incremental_per_tick': incremental_time / ticks,
+        'speedup': full_time / incremental_time,
+    }
+
+
+def bench_layout(args: argparse.Namespace) -> Dict[str, object]:
+    """Cutscene frame drawing with layouts cached against laying every Text and Ascii out again each frame"""
+    term = headless_terminal()
+    world = World()
+    art, _, caption = ordered_cutscenes[0][0]
+    world.create_entity(Ascii(art=art))
+    world.create_entity(Text(text_string=caption * 3))
+    frames = 100
+
+    def frame_loop(cached: bool) -> None:
+        for _ in range(frames):
+            if not cached:
+                layout_cache.clear()
+            text_renderer(term, world, 0.1, '')
+            ascii_renderer(term, world, 0.1, '')
+
+    with output_to(term.stream):
+        uncached = _best_of(lambda: frame_loop(False), args.repeat)
+        cached = _best_of(lambda: frame_loop(True), args.repeat)
+    term.stream.close()
+    return {
+        'art_lines': len(art),
+        'uncached_per_frame': uncached / frames,
+        'cached_per_frame': cached / frames,
+        'speedup': uncached / cached,
+    }
+
+
+class _SlowAsciicastRecorder(AsciicastRecorder):
+    """Writes every event as slowly as a disk that can't keep up with the game"""
+
+    def _write_event(self, frame: Tuple[float, str]) -> None:
+        time.sleep(0.002)
+        super(_SlowAsciicastRecorder, self)._write_event(frame)
+
+
+def bench_asciicast(args: argparse.Namespace) -> Dict[str, object]:
+    """Game thread time of recording level frames to an asciicast with each backpressure policy"""
+    term = headless_terminal()
+    frames = 300
+    moves = 'wasd'
+
+    def play(recorder: Optional[AsciicastRecorder]) -> float:
+        random.seed(0)
+        level = GameLevel(*mapgenerator(**LEVEL_PARAMETERS))
+        capture = FrameCapture(term.stream)
+        with output_to(capture if recorder is not None else term.stream):
+            level.setup(term)
+            start = time.perf_counter()
+            for frame in range(frames):
+                level.tick(term, 0.1, moves[frame // 4 % len(moves)])
+                if recorder is not None:
+                    recorder.record(capture.take())
+            elapsed = time.perf_counter() - start
+        level.teardown()
+        return elapsed
+
+    results: Dict[str, object] = {'frames': frames, 'budget_per_frame': FRAME_BUDGET}
+    plain = min(play(None) for _ in range(args.repeat))
+    results['plain_per_frame'] = plain / frames
+    with tempfile.TemporaryDirectory() as directory:
+        for recorder_type, disk in ((AsciicastRecorder, 'fast'), (_SlowAsciicastRecorder, 'slow')):
+            for policy in Backpressure:
+                path = os.path.join(directory, f'{disk}-{policy.value}.cast.gz')
+                with recorder_type(path, term.width, term.height, policy=policy, max_frames=32) as recorder:
+                    recorded = play(recorder)
+                stats = recorder.stats
+                results[f'{disk}_{policy.value}'] = {
+                    'overhead_per_frame': (recorded - plain) / frames,
+                    'record_per_frame': stats.overhead_per_frame,
+                    'over_budget': stats.over_budget,
+                    'dropped': stats.dropped,
+                    'coalesced': stats.coalesced,
+                    'blocked': stats.blocked,
+                    'events': stats.events,
+                    'compressed_bytes': os.path.getsize(path),
+                }
+    term.stream.close()
+    return results
+
+
+def _blocked_cell_by_cell(level_map: MapType, w: int, h: int, x: int, y: int) -> bool:
+    return any(
+        row < 0 or not 0 <= column < len(level_map[row]) or level_map[row][column] == '#'
+        for row in range(y - h + 1, y + 1) for column in range(x, x + w)
+    )
+
+
+def bench_footprint(args: argparse.Namespace) -> Dict[str, object]:
+    """Wall tests of sprites of growing size with footprint masks against checking every cell they cover"""
+    random.seed(0)
+    level_map, _ = mapgenerator(**dict(LEVEL_PARAMETERS, map_height=2000))
+    walls = WallGrid(level_map)
+    rng = random.Random(0)
+    positions = [(rng.randrange(-2, len(level_map[0])), rng.randrange(len(level_map))) for _ in range(args.count)]
+
+    results: Dict[str, object] = {'map': [len(level_map[0]), len(level_map)], 'tests': len(positions)}
+    for size in (1, 4, 8):
+        shape = footprint(size, size)
+        masked = [walls.blocks(shape, x, y) for x, y in positions]
+        if masked != [_blocked_cell_by_cell(level_map, size, size, x, y) for x, y in positions]:
+            raise AssertionError(f'Masked wall tests of {size}x{size} sprites differ from cell by cell ones')
+        masked_time = _best_of(lambda: [walls.blocks(shape, x, y) for x, y in positions], args.repeat)
+        cell_time = _best_of(
+            lambda: [_blocked_cell_by_cell(level_map, size, size, x, y) for x, y in positions], args.repeat
+        )
+        results[f'{size}x{size}'] = {
+            'masked_per_test': masked_time / len(positions),
+            'cell_by_cell_per_test': cell_time / len(positions),
+            'speedup': cell_time / masked_time,
+        }
+
+    big, small = footprint(8, 8), footprint(1, 1)
+    overlaps = _best_of(lambda: [big.overlaps(x, y, small, 10, 10) for x, y in positions], args.repeat)
+    results['overlap_per_test'] = overlaps / len(positions)
+    return results
+
+
+def _minimap_cell_by_cell(level_map: MapType, minimap: Minimap) -> List[str]:
+    rows = []
+    for top in range(0, len(level_map), 4 * minimap.scale_y):
+        line = []
+        for left in range(0, minimap.columns * 2 * minimap.scale_x, 2 * minimap.scale_x):
+            mask = 0
+            for y in range(top, min(top + 4 * minimap.scale_y, len(level_map))):
+                for x in range(left, min(left + 2 * minimap.scale_x, len(level_map[y]))):
+                    if level_map[y][x] != '#':
+                        mask |= 1 << (2 * ((y - top) // minimap.scale_y) + (x - left) // minimap.scale_x)
+            line.append(GLYPHS[mask])
+        rows.append(''.join(line))
+    return rows
+
+
+def bench_minimap(args: argparse.Namespace) -> Dict[str, object]:
+    """Packing a minimap of a long level a row of characters at a time against cell by cell"""
+    random.seed(0)
+    level_map, spawn = mapgenerator(**dict(LEVEL_PARAMETERS, map_height=2000))
+    minimap = Minimap(level_map)
+    if _minimap_cell_by_cell(level_map, minimap) != minimap.rows:
+        raise AssertionError('Packed minimap differs from the one built cell by cell')
+    positions = [(spawn, y) for y in range(0, len(level_map), 10)]
+
+    packed = _best_of(lambda: Minimap(level_map), args.repeat)
+    cell_by_cell = _best_of(lambda: _minimap_cell_by_cell(level_map, minimap), args.repeat)
+    marks = _best_of(lambda: minimap.marks(positions), args.repeat)
+    return {
+        'map': [len(level_map[0]), len(level_map)],
+        'minimap': [minimap.columns, len(minimap.rows)],
+        'packed': packed,
+        'cell_by_cell': cell_by_cell,
+        'speedup': cell_by_cell / packed,
+        'marks_per_frame': marks,
+        'marked_positions': len(positions),
+    }
+
+
+BENCHMARKS: Dict[str, Benchmark] = {
+    'ai_lod': bench_ai_lod,
+    'asciicast': bench_asciicast,
+    'footprint': bench_footprint,
+    'fov': bench_fov,
+    'layout': bench_layout,
+    'minimap': bench_minimap,
+    'schedule': bench_schedule,
+    'spawn': bench_spawn,
+}
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Entrypoint for the benchmarks"""
+    parser = argparse.ArgumentParser(description='Dedicated Dugongs benchmarks')
+    parser.add_argument('benchmarks', nargs='*', help=f'Benchmarks to run, all by default: {", ".join(BENCHMARKS)}')
+    parser.add_argument('--count', type=int, default=10000, help='Number of entities to benchmark with')
+    parser.add_argument('--repeat', type=int, default=5, help='Repetitions, the best one is reported')
+    args = parser.parse_args(argv)
+    unknown = set(args.benchmarks) - set(BENCHMARKS)
+    if unknown:
+        parser.error(f'unknown benchmarks: {", ".join(sorted(unknown))}')
+
+    results = {name: BENCHMARKS[name](args) for name in (args.benchmarks or sorted(BENCHMARKS))}
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
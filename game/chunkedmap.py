@@ -0,0 +1,77 @@
+import itertools
+import random
+import sys
+from collections import deque
+from typing import Deque, Iterator, List, Optional
+
+from game.mapgeneration import MapType, map_rows
+
+# Rows generated at a time
+CHUNK_ROWS = 32
+# Rows kept above the player, enough for the field of view and a rewind
+KEEP_BEHIND = 64
+
+
+class ChunkedMap(object):
+    """
+    A map generated a chunk of rows at a time as it is needed, indexed by row like a MapType.
+
+    Chunks are generated once a row in them is first indexed and dropped by follow once the player is far enough
+    below them, so the rows in memory stay the same however far the player goes. Rows that were dropped, and rows
+    above the map, read as solid wall. The map has its own random number generator, so its rows don't depend on
+    when they are generated. Iterating the map goes over the rows in memory.
+    """
+
+    def __init__(self, map_width: int, room_frequency: int, room_size: int, path_width: int,
+                 map_height: Optional[int] = None, chunk_rows: int = CHUNK_ROWS, keep_behind: int = KEEP_BEHIND,
+                 rng: Optional[random.Random] = None):
+        self.rng = rng or random.Random(random.getrandbits(64))
+        self.spawn, self._rows = map_rows(map_width, room_frequency, room_size, path_width, rng=self.rng)
+        self.map_height = map_height  # None for a map that never ends
+        self.chunk_rows = chunk_rows
+        self.keep_behind = keep_behind  # Rows kept above the row followed
+        self.first_row = 0  # First row still in memory
+        self.generated = 0  # Rows generated so far
+        self._chunks: Deque[MapType] = deque()
+        self._wall = ['#'] * (50 + map_width)
+
+    def __len__(self) -> int:
+        return self.map_height if self.map_height is not None else sys.maxsize
+
+    def __getitem__(self, y: int) -> List[str]:
+        if y < self.first_row:
+            return self._wall
+        if self.map_height is not None and y >= self.map_height:
+            raise IndexError(f'row {y} is past the end of the map')
+        while y >= self.generated:
+            self._generate()
+        offset = y - self.first_row
+        return self._chunks[offset // self.chunk_rows][offset % self.chunk_rows]
+
+    def __iter__(self) -> Iterator[List[str]]:
+        return itertools.chain.from_iterable(self._chunks)
+
+    @property
+    def resident_rows(self) -> int:
+        """Rows currently in memory"""
+        return self.generated - self.first_row
+
+    def _generate(self) -> None:
+        count = self.chunk_rows
+        if self.map_height is not None:
+            count = min(count, self.map_height - self.generated)
+        self._chunks.append(list(itertools.islice(self._rows, count)))
+        self.generated += count
+
+    def follow(self, y: int) -> int:
+        """
+        Drop the chunks that are entirely more than keep_behind rows above a row.
+
+        :param y: Row to keep the chunks around, usually the row the player is on
+        :return: Number of chunks dropped
+        """
+        dropped = 0
+        while self._chunks and self.first_row + self.chunk_rows <= y - self.keep_behind:
+            self.first_row += len(self._chunks.popleft())
+            dropped += 1
+        return dropped
@@ -1,6 +1,6 @@
 import dataclasses
 import enum
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 
 from game.ecs.component import Component
 from game.utils import Vector2
@@ -72,6 +72,11 @@ class Ascii(Component):
     bg_color: str = 'on_black'
 
 
+@dataclasses.dataclass
+class ReachedExit(Component):
+    """Component that marks an entity that stepped out of the level through its exit"""
+
+
 @dataclasses.dataclass
 class TimeToLive(Component):
     """Component that tracks expirable entities"""
@@ -91,4 +96,13 @@ class FollowAI(Component):
     """Component that tracks another transform"""
 
     follow_transform: Optional[Transform] = None
-    ticks_since_move: int = 0
+
+
+@dataclasses.dataclass
+class Vision(Component):
+    """Component that tracks what an entity can see and has seen of the map"""
+
+    radius: int = 8
+    origin: Optional[Tuple[int, int]] = None  # Position the visible cells were computed from
+    visible: Dict[int, int] = dataclasses.field(default_factory=dict)  # Row masks, bit x is set for column x
+    seen: Dict[int, int] = dataclasses.field(default_factory=dict)
@@ -0,0 +1,190 @@
+import itertools
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+from blessed import Terminal
+
+from game.fov import RowMask, iter_bits
+from game.mapgeneration import MapType
+
+Position = Tuple[int, int]
+# A character and the formatting it is drawn with, e.g. term.yellow_reverse
+Cell = Tuple[str, Callable[[str], str]]
+
+
+class Layer(object):
+    """Cells drawn on top of the background, layers with a higher z cover lower ones"""
+
+    def __init__(self, z: int, masked: bool = False, fixed: bool = False):
+        self.z = z
+        # Masked layers are only drawn where the background is visible, like sprites hidden in the dark
+        self.masked = masked
+        # Fixed layers are positioned on the terminal rather than on the background, and don't scroll with it
+        self.fixed = fixed
+        self.cells: Dict[Position, Cell] = {}
+
+
+class Compositor(object):
+    """
+    Draws a static background with z-ordered layers on top.
+
+    The background is rendered once and kept as styled rows. After the first frame only the cells layers
+    cover, or covered on the previous frame, are drawn again, the latter restored from the background.
+    The cost of a frame depends on the number of layer cells, not on the size of the background.
+
+    Once revealed is called the background is only drawn where it is visible, cells that were seen before are
+    drawn in seen_style and the rest is left blank.
+
+    Backgrounds taller than the terminal are shown from row top on, which follow moves along with the player.
+    """
+
+    def __init__(self, background: MapType, style: Callable[[str], str], blank_style: Callable[[str], str],
+                 seen_style: Optional[Callable[[str], str]] = None):
+        self.background = background
+        self.style = style
+        self.blank_style = blank_style
+        self.seen_style = seen_style or style
+        self.layers: List[Layer] = []
+        self.top = 0  # Background row drawn on the first line of the terminal
+        self._rows: Optional[List[str]] = None
+        self._size: Tuple[int, int] = (0, 0)
+        self._drawn: Dict[Position, Cell] = {}
+        self._visible: Optional[RowMask] = None
+        self._seen: RowMask = {}
+        # Background cells whose visibility changed since the last frame
+        self._dirty: Set[Position] = set()
+
+    def add_layer(self, layer: Layer) -> Layer:
+        """
+        Add a layer to draw on top of the background.
+
+        :param layer: Layer to add
+        :return: The same layer
+        """
+        self.layers.append(layer)
+        self.layers.sort(key=lambda existing: -existing.z)
+        return layer
+
+    def invalidate(self) -> None:
+        """
+        Redraw everything on the next frame, e.g. after the terminal was resized.
+
+        :return: None
+        """
+        self._rows = None
+
+    def follow(self, y: int, height: int) -> None:
+        """
+        Scroll the background so a row stays on screen, away from the top and bottom edges.
+
+        The view jumps to put the row in the middle rather than scrolling a line at a time, so the background is
+        only drawn again every few rows.
+
+        :param y: Background row to keep on screen
+        :param height: Rows the terminal has
+        :return: None
+        """
+        margin = height // 4
+        if self.top + margin <= y < self.top + height - margin:
+            return
+        top = max(0, min(y - height // 2, len(self.background) - height))
+        if top != self.top:
+            self.top = top
+            self.invalidate()
+
+    def reveal(self, visible: RowMask, seen: RowMask) -> None:
+        """
+        Limit the background to what can be seen.
+
+        Only cells that are visible now or were visible before are redrawn, the cost depends on the size of
+        the visible area and not on the size of the background.
+
+        :param visible: Cells that are visible, a new mask whenever they change
+        :param seen: Cells that have been visible at some point
+        :return: None
+        """
+        if visible is self._visible:
+            return
+        previous = self._visible
+        self._visible, self._seen = visible, seen
+        if previous is None:
+            # Everything that was drawn might be hidden now
+            self.invalidate()
+            return
+        for y in previous.keys() | visible.keys():
+            self._dirty.update((x, y) for x in iter_bits(previous.get(y, 0) ^ visible.get(y, 0)))
+
+    def _is_visible(self, position: Position) -> bool:
+        x, y = position
+        return self._visible is None or bool(self._visible.get(y, 0) >> x & 1)
+
+    def _background_cell(self, position: Position) -> Cell:
+        x, y = position
+        if not (0 <= y < len(self.background) and 0 <= x < len(self.background[y])):
+            return u' ', self.blank_style
+        if self._is_visible(position):
+            return self.background[y][x], self.style
+        if self._seen.get(y, 0) >> x & 1:
+            return self.background[y][x], self.seen_style
+        return u' ', self.blank_style
+
+    def _top_cell(self, position: Position) -> Cell:
+        x, y = position
+        for layer in self.layers:
+            cell = layer.cells.get((x, y - self.top) if layer.fixed else position)
+            if cell is not None and not (layer.masked and not self._is_visible(position)):
+                return cell
+        return self._background_cell(position)
+
+    def _full_frame(self, term: Terminal) -> List[str]:
+        width, height = self._size = term.width, term.height
+        rows = [(y, self.background[y]) for y in range(self.top, min(self.top + height, len(self.background)))]
+        if self._visible is None:
+            self._rows = [self.style(''.join(row[:width])) for _, row in rows]
+        else:
+            self._rows = []
+            for y, row in rows:
+                cells = (self._background_cell((x, y)) for x in range(min(width, len(row))))
+                # One style sequence per run of cells sharing a style
+                self._rows.append(''.join(
+                    style(''.join(character for character, _ in run))
+                    for style, run in itertools.groupby(cells, key=lambda cell: cell[1])
+                ))
+        out = [term.move_yx(0, 0), self.blank_style(term.clear)]
+        for y, row in enumerate(self._rows):
+            out.append(term.move_yx(y, 0) + row)
+        self._drawn = {}
+        self._dirty = set()
+        return out
+
+    def render(self, term: Terminal) -> str:
+        """
+        Build the output for the next frame.
+
+        :param term: Terminal to draw on
+        :return: Escape sequences and text to write
+        """
+        out = self._full_frame(term) if self._rows is None else []
+        width, height = self._size
+        top = self.top
+
+        covered: Set[Position] = set()
+        for layer in self.layers:
+            if layer.fixed:
+                covered.update((x, y + top) for x, y in layer.cells)
+            else:
+                covered.update(layer.cells)
+
+        drawn: Dict[Position, Cell] = {}
+        for position in covered | self._drawn.keys() | self._dirty:
+            x, y = position
+            if not (0 <= x < width and top <= y < top + height):
+                continue
+            cell = self._top_cell(position) if position in covered else self._background_cell(position)
+            if position in covered:
+                drawn[position] = cell
+            if self._drawn.get(position) != cell or position in self._dirty:
+                character, style = cell
+                out.append(term.move_yx(y - top, x) + style(character))
+        self._drawn = drawn
+        self._dirty = set()
+        return ''.join(out)
@@ -0,0 +1,73 @@
+from typing import Callable, List, Tuple
+
+from game.ecs import EntityId
+from game.ecs.component import Component
+
+
+class CommandBuffer(object):
+    """
+    Structural changes queued by processors during a tick.
+
+    The World applies them at its sync points, grouped by kind: creations, additions, removals and then deletions.
+    """
+
+    def __init__(self, reserve_id: Callable[[], EntityId]):
+        self._reserve_id = reserve_id
+        self.creates: List[Tuple[EntityId, Tuple[Component, ...]]] = []
+        self.adds: List[Tuple[EntityId, Tuple[Component, ...]]] = []
+        self.removes: List[Tuple[EntityId, Tuple[Component, ...]]] = []
+        self.deletes: List[EntityId] = []
+
+    def __len__(self) -> int:
+        return len(self.creates) + len(self.adds) + len(self.removes) + len(self.deletes)
+
+    def create(self, *components: Component) -> EntityId:
+        """
+        Queue the creation of an entity.
+
+        :param components: Components of the new entity
+        :return: ID the entity will have once created
+        """
+        entity_id = self._reserve_id()
+        self.creates.append((entity_id, components))
+        return entity_id
+
+    def delete(self, entity_id: EntityId) -> None:
+        """
+        Queue the deletion of an entity.
+
+        :param entity_id: ID of an entity
+        :return: None
+        """
+        self.deletes.append(entity_id)
+
+    def add(self, entity_id: EntityId, *components: Component) -> None:
+        """
+        Queue adding components to an entity.
+
+        :param entity_id: ID of an entity
+        :param components: Components to associate
+        :return: None
+        """
+        self.adds.append((entity_id, components))
+
+    def remove(self, entity_id: EntityId, *components: Component) -> None:
+        """
+        Queue removing components from an entity.
+
+        :param entity_id: ID of an entity
+        :param components: Components to remove
+        :return: None
+        """
+        self.removes.append((entity_id, components))
+
+    def clear(self) -> None:
+        """
+        Drop every queued command.
+
+        :return: None
+        """
+        self.creates.clear()
+        self.adds.clear()
+        self.removes.clear()
+        self.deletes.clear()
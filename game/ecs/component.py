@@ -4,12 +4,32 @@ from typing import Optional
 from game.ecs import EntityId
 
 
+def _journaled_setattr(component: 'Component', name: str, value: object) -> None:
+    # Components of a world with a journal report their changes to it, see World.enable_journal
+    journal = component.__dict__.get('_journal')
+    if journal is not None:
+        journal.field_changed(component, name)
+    object.__setattr__(component, name, value)
+
+
 @dataclasses.dataclass
 class Component:
     """Base class for all components"""
 
     entity: Optional[EntityId] = None
 
+    @classmethod
+    def enable_journaling(cls) -> None:
+        """
+        Have components of this type report changes to their fields to the journal they are attached to.
+
+        Component types only pay for the check once a journaled world holds one of them.
+
+        :return: None
+        """
+        if cls.__setattr__ is not _journaled_setattr:
+            cls.__setattr__ = _journaled_setattr
+
     def with_id(self, _id: EntityId) -> 'Component':
         """
         Associate an entity with this component
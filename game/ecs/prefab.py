@@ -0,0 +1,32 @@
+import dataclasses
+from typing import Dict, List, Optional, Type
+
+from game.ecs.component import Component
+
+# Field values to use instead of a prefab's defaults, keyed by component type
+ComponentOverrides = Dict[Type[Component], Dict[str, object]]
+
+
+@dataclasses.dataclass
+class Prefab(object):
+    """
+    A named bundle of component types and the field defaults to create them with.
+
+    Defaults are passed to every instance as they are, so mutable defaults end up shared between entities.
+    """
+
+    name: str
+    components: Dict[Type[Component], Dict[str, object]]
+
+    def instantiate(self, overrides: Optional[ComponentOverrides] = None) -> List[Component]:
+        """
+        Create the components of a single entity from this prefab.
+
+        :param overrides: Field values to use instead of the defaults
+        :return: New components, not yet associated with an entity
+        """
+        overrides = overrides or {}
+        return [
+            c_type(**{**defaults, **overrides.get(c_type, {})})
+            for c_type, defaults in self.components.items()
+        ]
@@ -0,0 +1,68 @@
+from typing import Callable, FrozenSet, Iterable, List, Optional, Tuple
+
+from game.ecs import ProcessorFunc
+
+
+def access(reads: Iterable[type] = (), writes: Iterable[type] = ()) -> Callable[[ProcessorFunc], ProcessorFunc]:
+    """
+    Declare the component types a processor reads and writes.
+
+    Other shared resources, like the Terminal for processors that draw, are declared the same way.
+    Processors without a declaration are assumed to touch everything and always run on their own.
+
+    :param reads: Types the processor only reads
+    :param writes: Types the processor modifies
+    :return: Decorator recording the declaration on the processor
+    """
+    def decorate(func: ProcessorFunc) -> ProcessorFunc:
+        func.reads = frozenset(reads)
+        func.writes = frozenset(writes)
+        return func
+
+    return decorate
+
+
+def _declared(func: ProcessorFunc) -> Optional[Tuple[FrozenSet[type], FrozenSet[type]]]:
+    reads, writes = getattr(func, 'reads', None), getattr(func, 'writes', None)
+    if reads is None or writes is None:
+        return None
+    return reads, writes
+
+
+def conflicts(first: ProcessorFunc, second: ProcessorFunc) -> bool:
+    """
+    Check whether two processors may not run at the same time.
+
+    :param first: A processor
+    :param second: Another processor
+    :return: True if either writes something the other reads or writes
+    """
+    first_access, second_access = _declared(first), _declared(second)
+    if first_access is None or second_access is None:
+        return True
+    first_reads, first_writes = first_access
+    second_reads, second_writes = second_access
+    return bool(first_writes & (second_reads | second_writes) or second_writes & first_reads)
+
+
+def build_stages(processors: List[ProcessorFunc]) -> List[List[ProcessorFunc]]:
+    """
+    Group processors into stages whose members can run concurrently.
+
+    A processor is placed in the stage after the last earlier processor it conflicts with, so conflicting
+    processors keep their registration order and everything else runs as early as possible.
+
+    :param processors: Processors in registration order
+    :return: Stages in execution order
+    """
+    stage_of: List[int] = []
+    stages: List[List[ProcessorFunc]] = []
+    for idx, func in enumerate(processors):
+        stage = 1 + max(
+            (stage_of[earlier] for earlier in range(idx) if conflicts(processors[earlier], func)), default=-1
+        )
+        stage_of.append(stage)
+        if stage == len(stages):
+            stages.append([])
+        stages[stage].append(func)
+    return stages
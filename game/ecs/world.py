@@ -1,18 +1,233 @@
-from typing import Dict, Generator, List, Optional, Type, TypeVar
+import dataclasses
+import sys
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import Executor
+from contextvars import copy_context
+from typing import (
+    TYPE_CHECKING, Deque, Dict, Iterable, List, Optional, Sequence, Set, Tuple,
+    Type, TypeVar, Union, ValuesView
+)
 
 from blessed import Terminal
 
 from game.ecs import EntityId, ProcessorFunc
+from game.ecs.commands import CommandBuffer
 from game.ecs.component import Component
+from game.ecs.scheduler import build_stages
+
+if TYPE_CHECKING:
+    from game.ecs.prefab import ComponentOverrides, Prefab
 
 _T = TypeVar("_T")
 
+_NO_COMPONENTS: Dict[EntityId, Component] = {}
+
+
+def _estimate_size(obj: object, seen: Set[int]) -> int:
+    """Estimate the bytes held by an object and everything it references that hasn't been seen yet"""
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, int, float, bool, type(None), type)):
+        return size
+    if isinstance(obj, dict):
+        size += sum(_estimate_size(k, seen) + _estimate_size(v, seen) for k, v in obj.items())
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        size += sum(_estimate_size(item, seen) for item in obj)
+    elif hasattr(obj, '__dict__'):
+        size += _estimate_size(vars(obj), seen)
+    return size
+
+
+# Marks a field that had no value before it was set
+_UNSET = object()
+# Estimated bytes of a journal entry, besides the previous value of a field
+_ENTRY_BYTES = 120
+
+# A structural change: created or deleted entity, or added or removed component, and the entity it happened to
+StructuralChange = Tuple[str, EntityId, Optional[Component]]
+
+
+@dataclasses.dataclass
+class ComponentChanges(object):
+    """
+    Entities that gained or lost a component type, collected by the world for whoever watches the type.
+
+    An entity that gains and loses the component between two takes only ends up in the last set it was put in.
+    """
 
-def _id_generator() -> Generator[EntityId, None, None]:
-    n = 0
-    while True:
-        yield EntityId(n)
-        n = n + 1
+    added: Set[EntityId] = dataclasses.field(default_factory=set)
+    removed: Set[EntityId] = dataclasses.field(default_factory=set)
+    closed: bool = False  # The world was reset and doesn't collect changes for this anymore
+
+    def note(self, entity_ids: Iterable[EntityId], added: bool) -> None:
+        """
+        Collect entities that gained or lost the component.
+
+        :param entity_ids: IDs of the entities
+        :param added: Whether the component was added, or removed
+        :return: None
+        """
+        gained, lost = (self.added, self.removed) if added else (self.removed, self.added)
+        for entity_id in entity_ids:
+            lost.discard(entity_id)
+            gained.add(entity_id)
+
+    def take(self) -> Tuple[Set[EntityId], Set[EntityId]]:
+        """
+        Take the changes collected since the last call.
+
+        :return: Entities that gained the component and entities that lost it
+        """
+        changes = self.added, self.removed
+        self.added, self.removed = set(), set()
+        return changes
+
+
+@dataclasses.dataclass
+class TickRecord(object):
+    """Everything needed to undo a single tick"""
+
+    time: float
+    next_id: int
+    dt: float = 0.0
+    # (id(component), field) mapped to the component, field and value the field had before the tick
+    fields: Dict[Tuple[int, str], Tuple[Component, str, object]] = dataclasses.field(default_factory=dict)
+    changes: List[StructuralChange] = dataclasses.field(default_factory=list)
+    size: int = 0
+
+
+class Journal(object):
+    """
+    Inverse deltas of the last ticks of a world, kept within a memory budget.
+
+    Only the first change to a field within a tick is recorded, along with every entity and component that was
+    created or deleted, so the memory used depends on how much changed and not on the size of the world.
+    Once the records pass the budget the oldest ticks are dropped.
+    """
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.records: Deque[TickRecord] = deque()
+        self.size = 0
+        self.seconds = 0.0  # Game time the records cover
+        self._current: Optional[TickRecord] = None
+
+    def track(self, component: Component) -> None:
+        """
+        Have a component report changes to its fields.
+
+        :param component: Component of the journaled world
+        :return: None
+        """
+        type(component).enable_journaling()
+        object.__setattr__(component, '_journal', self)
+
+    def close(self, components: Iterable[Component]) -> None:
+        """
+        Drop every record and detach the journal from components, so neither keeps the other alive.
+
+        :param components: Components of the journaled world, those in the records are detached too
+        :return: None
+        """
+        records = list(self.records)
+        if self._current is not None:
+            records.append(self._current)
+        for record in records:
+            for component, _, _ in record.fields.values():
+                component.__dict__.pop('_journal', None)
+            for _, _, component in record.changes:
+                if component is not None:
+                    component.__dict__.pop('_journal', None)
+        for component in components:
+            component.__dict__.pop('_journal', None)
+        self.records.clear()
+        self._current = None
+        self.size = 0
+        self.seconds = 0.0
+
+    def field_changed(self, component: Component, name: str) -> None:
+        """
+        Record the value of a field that is about to change.
+
+        :param component: Component being changed
+        :param name: Name of the field
+        :return: None
+        """
+        record = self._current
+        if record is None:
+            return
+        key = (id(component), name)
+        if key not in record.fields:
+            old = component.__dict__.get(name, _UNSET)
+            record.fields[key] = (component, name, old)
+            record.size += _ENTRY_BYTES + sys.getsizeof(old)
+
+    def structural(self, kind: str, entity_id: EntityId, component: Optional[Component] = None) -> None:
+        """
+        Record a structural change.
+
+        :param kind: One of create, delete, add or remove
+        :param entity_id: ID of the entity that changed
+        :param component: Component that was added or removed
+        :return: None
+        """
+        if self._current is not None:
+            self._current.changes.append((kind, entity_id, component))
+            self._current.size += _ENTRY_BYTES
+
+    def begin_tick(self, world_time: float, next_id: int) -> None:
+        """
+        Start recording a tick.
+
+        :param world_time: World clock before the tick
+        :param next_id: Next entity ID before the tick
+        :return: None
+        """
+        self._current = TickRecord(time=world_time, next_id=next_id)
+
+    def end_tick(self, dt: float) -> None:
+        """
+        Finish recording a tick and drop the oldest ones over the budget.
+
+        :param dt: Delta the tick advanced the world clock by
+        :return: None
+        """
+        record, self._current = self._current, None
+        record.dt = dt
+        self.records.append(record)
+        self.size += record.size
+        self.seconds += dt
+        while self.size > self.budget and len(self.records) > 1:
+            oldest = self.records.popleft()
+            self.size -= oldest.size
+            self.seconds -= oldest.dt
+
+    def ticks_within(self, seconds: float) -> int:
+        """
+        Count the recorded ticks it takes to go back some time.
+
+        :param seconds: Game time to go back
+        :return: Number of ticks, fewer if the journal doesn't reach that far back
+        """
+        ticks, covered = 0, 0.0
+        for record in reversed(self.records):
+            if covered >= seconds:
+                break
+            covered += record.dt
+            ticks += 1
+        return ticks
+
+    def report(self) -> Dict[str, float]:
+        """
+        Report how far back the journal reaches.
+
+        :return: Recorded ticks, the seconds they cover, and the estimated bytes they use against the budget
+        """
+        return {'ticks': len(self.records), 'seconds': self.seconds, 'bytes': self.size, 'budget': self.budget}
 
 
 class World(object):
@@ -20,13 +235,68 @@ class World(object):
 
     entities: set[EntityId]
     components: Dict[Type[_T], Dict[EntityId, Component]]
-    processors: set[ProcessorFunc]
+    # Dict used as an insertion ordered set so processors run in registration order every run
+    processors: Dict[ProcessorFunc, None]
+    # Structural changes processors queue while iterating, applied between processors
+    commands: CommandBuffer
+    time: float
+    # Runs processors that share a stage concurrently, None runs everything serially
+    executor: Optional[Executor]
+    # Records the changes of every tick so they can be undone, None when not enabled
+    journal: Optional[Journal]
 
-    def __init__(self):
-        self.id_generator = _id_generator()
+    def __init__(self, executor: Optional[Executor] = None):
+        self.next_id = 0
         self.entities = set()
         self.components = {}
-        self.processors = set()
+        self.processors = {}
+        self.commands = CommandBuffer(self._reserve_id)
+        self.time = 0.0
+        self.executor = executor
+        self.journal = None
+        self._id_lock = threading.Lock()
+        self._watches: Dict[type, List[ComponentChanges]] = {}
+        self._stages: Optional[List[List[ProcessorFunc]]] = None
+        # Timings of the last tick
+        self.stage_times: List[float] = []
+        self.processor_times: Dict[ProcessorFunc, float] = {}
+
+    def reset(self) -> None:
+        """
+        Clear all entities, components and processors so the world can be reused.
+
+        The world keeps its storage dict for every component type it has seen, so a recycled world doesn't
+        rebuild them, and dropping the components releases references between them, like a FollowAI's
+        followed Transform, without waiting for the cyclic garbage collector.
+
+        :return: None
+        """
+        if self.journal is not None:
+            # Tracked components and the records holding them reference each other
+            self.journal.close(component for component_map in self.components.values()
+                               for component in component_map.values())
+        for component_map in self.components.values():
+            component_map.clear()
+        for watches in self._watches.values():
+            for changes in watches:
+                changes.closed = True
+        self._watches = {}
+        self.entities.clear()
+        self.processors.clear()
+        self.commands.clear()
+        self._stages = None
+        self.stage_times = []
+        self.processor_times = {}
+        self.next_id = 0
+        self.time = 0.0
+        self.journal = None
+
+    def _reserve_id(self) -> EntityId:
+        # Processors in the same stage may queue creations from different threads
+        with self._id_lock:
+            entity_id = EntityId(self.next_id)
+            self.next_id += 1
+        return entity_id
 
     def create_entity(self, *components: Component) -> EntityId:
         """
@@ -35,13 +305,66 @@ class World(object):
         :param components: List of components to add to new entity
         :return: Entity ID
         """
-        entity_id = next(self.id_generator)
+        entity_id = self._reserve_id()
 
         self.entities.add(entity_id)
+        if self.journal is not None:
+            self.journal.structural('create', entity_id)
         self.add_components(entity_id, *components)
 
         return entity_id
 
+    def spawn_batch(
+            self,
+            prefab: 'Prefab',
+            count: int,
+            overrides: Optional[Union['ComponentOverrides', Sequence['ComponentOverrides']]] = None
+    ) -> List[EntityId]:
+        """
+        Create many entities from a prefab at once.
+
+        IDs are reserved up front and each component type's storage is filled in a single pass.
+
+        :param prefab: Prefab to instantiate
+        :param count: Number of entities to create
+        :param overrides: Field overrides shared by every entity, or a sequence with one per entity
+        :return: IDs of the new entities
+        """
+        per_entity = overrides is not None and not isinstance(overrides, dict)
+        if per_entity and len(overrides) != count:
+            raise ValueError(f'Expected {count} overrides, got {len(overrides)}')
+
+        # Reserved the same way as single IDs, so a creation queued from another thread can't take one of them
+        with self._id_lock:
+            first_id = self.next_id
+            self.next_id += count
+        ids = [EntityId(n) for n in range(first_id, first_id + count)]
+        self.entities.update(ids)
+
+        for c_type, defaults in prefab.components.items():
+            if per_entity:
+                new_components = [
+                    c_type(entity=entity_id, **{**defaults, **entity_overrides.get(c_type, {})})
+                    for entity_id, entity_overrides in zip(ids, overrides)
+                ]
+            else:
+                fields = {**defaults, **overrides.get(c_type, {})} if overrides else defaults
+                new_components = [c_type(entity=entity_id, **fields) for entity_id in ids]
+
+            if c_type not in self.components:
+                self.components[c_type] = {}
+            self.components[c_type].update(zip(ids, new_components))
+            if self.journal is not None:
+                for entity_id, component in zip(ids, new_components):
+                    self._journal_added(entity_id, component, None)
+            if c_type in self._watches:
+                self._note(c_type, ids, True)
+
+        if self.journal is not None:
+            for entity_id in ids:
+                self.journal.structural('create', entity_id)
+        return ids
+
     def delete_entity(self, entity_id: EntityId) -> None:
         """
         Delete an entity and all associated components from the world.
@@ -52,10 +375,16 @@ class World(object):
         if entity_id in self.entities:
             # TODO: Could speed this up at the cost of memory by keeping a dict of entity_id -> Set[Type[Component]]
             #       and using that to shortcut looking through each component bucket.
-            for component_map in self.components.values():
+            for c_type, component_map in self.components.items():
                 if entity_id in component_map:
+                    if self.journal is not None:
+                        self.journal.structural('remove', entity_id, component_map[entity_id])
                     del component_map[entity_id]
+                    if c_type in self._watches:
+                        self._note(c_type, (entity_id,), False)
             self.entities.discard(entity_id)
+            if self.journal is not None:
+                self.journal.structural('delete', entity_id)
 
     def add_components(self, entity_id: EntityId, *components: Component) -> None:
         """
@@ -69,7 +398,11 @@ class World(object):
             c_type = type(component)
             if c_type not in self.components:
                 self.components[c_type] = {}
+            if self.journal is not None:
+                self._journal_added(entity_id, component, self.components[c_type].get(entity_id))
             self.components[c_type][entity_id] = component.with_id(entity_id)
+            if c_type in self._watches:
+                self._note(c_type, (entity_id,), True)
 
     def get_component(self, entity_id: EntityId, component_type: Type[_T]) -> Optional[_T]:
         """
@@ -84,6 +417,18 @@ class World(object):
         else:
             return None
 
+    def view(self, component_type: Type[_T]) -> ValuesView[_T]:
+        """
+        Returns a live view of all components of a matching type.
+
+        Nothing is copied, so the world must not be changed structurally while iterating it. Processors queue
+        those changes on world.commands instead.
+
+        :param component_type: Component class type
+        :return: View of the components
+        """
+        return self.components.get(component_type, _NO_COMPONENTS).values()
+
     def get_components(self, component_type: Type[_T]) -> list[_T]:
         """
         Returns a list of all components of a matching type.
@@ -107,9 +452,178 @@ class World(object):
         for component in components:
             c_type = type(component)
             try:
-                del self.components[c_type][entity]
+                removed = self.components[c_type].pop(entity)
             except KeyError:
-                pass
+                continue
+            if self.journal is not None:
+                self.journal.structural('remove', entity, removed)
+            if c_type in self._watches:
+                self._note(c_type, (entity,), False)
+
+    def apply_commands(self) -> None:
+        """
+        Apply the structural changes queued on the command buffer.
+
+        Commands are grouped so each component type's storage is touched once per kind of change.
+
+        :return: None
+        """
+        commands = self.commands
+        if not len(commands):
+            return
+
+        for entity_id, _ in commands.creates:
+            self.entities.add(entity_id)
+            if self.journal is not None:
+                self.journal.structural('create', entity_id)
+        self._store(commands.creates)
+        self._store(commands.adds)
+
+        removals: Dict[type, List[EntityId]] = defaultdict(list)
+        for entity_id, components in commands.removes:
+            for component in components:
+                removals[type(component)].append(entity_id)
+        for c_type, entity_ids in removals.items():
+            self._discard(c_type, entity_ids)
+
+        if commands.deletes:
+            for c_type in self.components:
+                self._discard(c_type, commands.deletes)
+            if self.journal is not None:
+                for entity_id in commands.deletes:
+                    if entity_id in self.entities:
+                        self.journal.structural('delete', entity_id)
+            self.entities.difference_update(commands.deletes)
+
+        commands.clear()
+
+    def _store(self, batch: List[tuple]) -> None:
+        """Store (entity, components) pairs, grouped per component type"""
+        grouped: Dict[type, Dict[EntityId, Component]] = defaultdict(dict)
+        for entity_id, components in batch:
+            for component in components:
+                grouped[type(component)][entity_id] = component.with_id(entity_id)
+        for c_type, new_components in grouped.items():
+            if c_type not in self.components:
+                self.components[c_type] = {}
+            if self.journal is not None:
+                for entity_id, component in new_components.items():
+                    self._journal_added(entity_id, component, self.components[c_type].get(entity_id))
+            self.components[c_type].update(new_components)
+            if c_type in self._watches:
+                self._note(c_type, new_components, True)
+
+    def _discard(self, c_type: type, entity_ids: Iterable[EntityId]) -> None:
+        component_map = self.components.get(c_type, _NO_COMPONENTS)
+        watched = c_type in self._watches
+        for entity_id in entity_ids:
+            removed = component_map.pop(entity_id, None)
+            if removed is not None:
+                if self.journal is not None:
+                    self.journal.structural('remove', entity_id, removed)
+                if watched:
+                    self._note(c_type, (entity_id,), False)
+
+    def _note(self, c_type: type, entity_ids: Iterable[EntityId], added: bool) -> None:
+        for changes in self._watches[c_type]:
+            changes.note(entity_ids, added)
+
+    def watch(self, component_type: Type[Component]) -> ComponentChanges:
+        """
+        Collect the entities that gain or lose a component type, so they can be found without a scan.
+
+        Every entity that has the component when watching starts counts as added. Changes are collected until
+        the world is reset, which closes them.
+
+        :param component_type: Component class type to watch
+        :return: The changes, collected as they happen
+        """
+        changes = ComponentChanges()
+        changes.note(self.components.get(component_type, _NO_COMPONENTS), True)
+        self._watches.setdefault(component_type, []).append(changes)
+        return changes
+
+    def _journal_added(self, entity_id: EntityId, component: Component, replaced: Optional[Component]) -> None:
+        if replaced is not None and replaced is not component:
+            self.journal.structural('remove', entity_id, replaced)
+        self.journal.structural('add', entity_id, component)
+        self.journal.track(component)
+
+    def enable_journal(self, budget: int = 1 << 20) -> Journal:
+        """
+        Start recording the changes of every tick, so ticks can be undone with rewind.
+
+        Changes made outside of ticks, like setting up a level, are not recorded and can't be undone.
+
+        :param budget: Estimated bytes the journal may use, the oldest ticks are dropped beyond it
+        :return: The journal
+        """
+        self.journal = Journal(budget)
+        for component_map in self.components.values():
+            for component in component_map.values():
+                self.journal.track(component)
+        return self.journal
+
+    def rewind(self, ticks: int) -> int:
+        """
+        Undo the last ticks recorded by the journal.
+
+        :param ticks: Number of ticks to undo
+        :return: Number of ticks undone, fewer if the journal doesn't reach that far back
+        """
+        journal = self.journal
+        if journal is None:
+            return 0
+        undone = 0
+        while undone < ticks and journal.records:
+            record = journal.records.pop()
+            journal.size -= record.size
+            journal.seconds -= record.dt
+            for component, name, old in record.fields.values():
+                # Bypasses the journal, undoing a change is not a change to record
+                if old is _UNSET:
+                    component.__dict__.pop(name, None)
+                else:
+                    object.__setattr__(component, name, old)
+            for kind, entity_id, component in reversed(record.changes):
+                if kind == 'create':
+                    self.entities.discard(entity_id)
+                elif kind == 'delete':
+                    self.entities.add(entity_id)
+                elif kind == 'add':
+                    component_map = self.components[type(component)]
+                    if component_map.get(entity_id) is component:
+                        del component_map[entity_id]
+                        if type(component) in self._watches:
+                            self._note(type(component), (entity_id,), False)
+                else:
+                    self.components.setdefault(type(component), {})[entity_id] = component
+                    if type(component) in self._watches:
+                        self._note(type(component), (entity_id,), True)
+            self.time, self.next_id = record.time, record.next_id
+            undone += 1
+        return undone
+
+    def memory_stats(self) -> Dict[str, Dict[str, int]]:
+        """
+        Estimate the memory used by each component type.
+
+        Objects shared between components, like a followed Transform, are only counted once.
+
+        :return: Component type name mapped to its count and estimated bytes
+        """
+        # Components reference the journal, which is not part of their size
+        seen: Set[int] = {id(self.journal)} if self.journal is not None else set()
+        stats = {}
+        for c_type, component_map in self.components.items():
+            stats[c_type.__name__] = {
+                'count': len(component_map),
+                'bytes': sys.getsizeof(component_map) + sum(
+                    _estimate_size(component, seen) for component in component_map.values()
+                ),
+            }
+        stats['entities'] = {'count': len(self.entities), 'bytes': _estimate_size(self.entities, seen)}
+        return stats
 
     def register_processor(self, func: ProcessorFunc) -> None:
         """
@@ -118,7 +632,8 @@ class World(object):
         :param func: Callable
         :return: None
         """
-        self.processors.add(func)
+        self.processors[func] = None
+        self._stages = None
 
     def remove_processor(self, func: ProcessorFunc) -> None:
         """
@@ -127,13 +642,68 @@ class World(object):
         :param func: Callable
         :return: None
         """
-        self.processors.discard(func)
+        self.processors.pop(func, None)
+        self._stages = None
+
+    @property
+    def stages(self) -> List[List[ProcessorFunc]]:
+        """Processors grouped into stages by their declared component access"""
+        if self._stages is None:
+            self._stages = build_stages(list(self.processors))
+        return self._stages
+
+    def schedule_report(self) -> Dict[str, object]:
+        """
+        Report how the last tick was scheduled.
+
+        :return: Stages with their processors and wall times, and the time running them one by one would take
+        """
+        serial = sum(self.processor_times.values())
+        scheduled = sum(self.stage_times)
+        return {
+            'stages': [
+                {'processors': [func.__qualname__ for func in stage], 'wall_time': wall_time}
+                for stage, wall_time in zip(self.stages, self.stage_times)
+            ],
+            'serial_time': serial,
+            'scheduled_time': scheduled,
+            'saved': serial - scheduled,
+        }
 
-    def tick(self, term: Terminal, dt: float, inp: str) -> None:
+    def tick(self, term: Optional[Terminal], dt: float, inp: str) -> None:
         """
         Tick all processors.
 
+        :param term: Terminal reference, None when no render processors are registered
+        :param dt: Time elapsed since the last tick, added to the world's clock
+        :param inp: Keyboard input
         :return: None
         """
-        for func in self.processors:
-            func(term, self, dt, inp)
+        if self.journal is not None:
+            self.journal.begin_tick(self.time, self.next_id)
+        self.time += dt
+        self.stage_times = []
+        self.processor_times = {}
+        for stage in self.stages:
+            start = time.perf_counter()
+            if self.executor is not None and len(stage) > 1:
+                # Context is copied so processors keep writing to the session's output stream
+                futures = [
+                    self.executor.submit(copy_context().run, self._run_processor, func, term, dt, inp)
+                    for func in stage
+                ]
+                for future in futures:
+                    future.result()
+            else:
+                for func in stage:
+                    self._run_processor(func, term, dt, inp)
+            # Sync point, structural changes become visible to the next stage
+            self.apply_commands()
+            self.stage_times.append(time.perf_counter() - start)
+        if self.journal is not None:
+            self.journal.end_tick(dt)
+
+    def _run_processor(self, func: ProcessorFunc, term: Optional[Terminal], dt: float, inp: str) -> None:
+        start = time.perf_counter()
+        func(term, self, dt, inp)
+        self.processor_times[func] = time.perf_counter() - start
@@ -0,0 +1,143 @@
+import dataclasses
+import functools
+from typing import Dict, List, Tuple
+
+from game.chunkedmap import ChunkedMap
+from game.mapgeneration import MapType
+
+# Rows and bands of walls kept by a WallGrid, it starts over beyond this
+MAX_CACHED_ROWS = 1 << 14
+
+# Turns a row into a binary number with the walls set, least significant bit last
+_WALL_BITS = str.maketrans({'#': '1', ' ': '0'})
+
+
+@dataclasses.dataclass(frozen=True)
+class Footprint(object):
+    """
+    The cells a sprite covers, as a bit mask per row.
+
+    Sprites stand on their position and reach upwards, like render_system draws them: row i of the footprint
+    is i rows above the position, and bit x of a row is x columns to the right of it.
+    """
+
+    rows: Tuple[int, ...]
+    # Every row has the same mask, so the footprint can be tested against all the rows it covers or'ed together
+    uniform: bool = False
+
+    def overlaps(self, x: int, y: int, other: 'Footprint', other_x: int, other_y: int) -> bool:
+        """
+        Check whether this footprint shares a cell with another one.
+
+        :param x: X coordinate of this footprint
+        :param y: Y coordinate of this footprint
+        :param other: Footprint to test against
+        :param other_x: X coordinate of the other footprint
+        :param other_y: Y coordinate of the other footprint
+        :return: True if any cell is covered by both
+        """
+        # Row i of this footprint is on the same row as row i + other_y - y of the other one
+        offset = other_y - y
+        for i in range(max(0, -offset), min(len(self.rows), len(other.rows) - offset)):
+            if (self.rows[i] << max(0, x - other_x)) & (other.rows[i + offset] << max(0, other_x - x)):
+                return True
+        return False
+
+
+@functools.lru_cache(maxsize=None)
+def footprint(w: int, h: int) -> Footprint:
+    """
+    Compile the footprint of a w by h sprite, once per size.
+
+    :param w: Width of the sprite
+    :param h: Height of the sprite
+    :return: The footprint
+    """
+    return Footprint(rows=((1 << w) - 1,) * h, uniform=True)
+
+
+class WallGrid(object):
+    """
+    The walls of a map as a bit mask per row, to test footprints against.
+
+    Rows are converted when first tested and kept until a different row object is found at their index, cells
+    outside the map count as walls. Rows aren't expected to change in place while the map is played. Uniform
+    footprints are tested against bands, the walls of all the rows they cover or'ed together, so their cost
+    doesn't grow with their height once the band is cached. Maps only ever replace rows from the top, a ChunkedMap
+    dropping chunks, so a band is still valid while its top row is. Walls of rows a ChunkedMap dropped are
+    forgotten, so they don't keep the rows in memory.
+    """
+
+    def __init__(self, level_map: MapType):
+        self.level_map = level_map
+        self._rows: Dict[int, Tuple[List[str], int]] = {}
+        self._bands: Dict[Tuple[int, int], Tuple[List[str], int]] = {}
+        self._first_row = 0  # First row of a ChunkedMap when the walls were last pruned
+
+    def _prune(self) -> None:
+        first_row = self.level_map.first_row if isinstance(self.level_map, ChunkedMap) else 0
+        if first_row != self._first_row:
+            self._first_row = first_row
+            self._rows = {y: cached for y, cached in self._rows.items() if y >= first_row}
+            self._bands = {key: cached for key, cached in self._bands.items() if key[0] - key[1] + 1 >= first_row}
+        if len(self._rows) >= MAX_CACHED_ROWS:
+            self._rows.clear()
+        if len(self._bands) >= MAX_CACHED_ROWS:
+            self._bands.clear()
+
+    def row(self, y: int) -> int:
+        """
+        Get the walls of a row.
+
+        :param y: Y coordinate of the row
+        :return: Mask with bit x set if x is a wall, or past the end of the row
+        """
+        if y < 0:
+            return -1
+        row = self.level_map[y]
+        cached = self._rows.get(y)
+        if cached is None or cached[0] is not row:
+            self._prune()
+            # Python ints are infinitely sign extended, so everything right of the row is a wall too
+            walls = int(''.join(row).translate(_WALL_BITS)[::-1] or '0', 2) | (-1 << len(row))
+            cached = self._rows[y] = (row, walls)
+        return cached[1]
+
+    def band(self, y: int, height: int) -> int:
+        """
+        Get the walls of several rows or'ed together.
+
+        :param y: Y coordinate of the bottom row
+        :param height: Number of rows, going up from y
+        :return: Mask with bit x set if x is a wall in any of the rows
+        """
+        top = y - height + 1
+        if top < 0:
+            return -1
+        row = self.level_map[top]
+        cached = self._bands.get((y, height))
+        if cached is None or cached[0] is not row:
+            self._prune()
+            walls = 0
+            for band_y in range(top, y + 1):
+                walls |= self.row(band_y)
+            cached = self._bands[(y, height)] = (row, walls)
+        return cached[1]
+
+    def blocks(self, shape: Footprint, x: int, y: int) -> bool:
+        """
+        Check whether a footprint overlaps a wall, with a single mask test for uniform footprints.
+
+        :param shape: Footprint to test
+        :param x: X coordinate of the footprint
+        :param y: Y coordinate of the footprint
+        :return: True if any cell of the footprint is a wall or outside the map
+        """
+        if x < 0:
+            return True
+        if shape.uniform:
+            return self.band(y, len(shape.rows)) >> x & shape.rows[0] != 0
+        for i, mask in enumerate(shape.rows):
+            if self.row(y - i) >> x & mask:
+                return True
+        return False
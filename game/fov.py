@@ -0,0 +1,85 @@
+from typing import Dict, Iterator
+
+from game.mapgeneration import MapType
+
+# A set of cells as one int per row, bit x of a row is set when the cell at x is in the set
+RowMask = Dict[int, int]
+
+# Transforms from the first octant to each of the eight octants around the origin
+_OCTANTS = (
+    (1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+    (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1),
+)
+
+
+def iter_bits(row: int) -> Iterator[int]:
+    """
+    Iterate the set bits of a row mask.
+
+    :param row: Mask of a row
+    :return: Iterator over the x coordinates of the set bits, lowest first
+    """
+    while row:
+        low = row & -row
+        yield low.bit_length() - 1
+        row ^= low
+
+
+def _blocks(level_map: MapType, x: int, y: int) -> bool:
+    return not (0 <= y < len(level_map) and 0 <= x < len(level_map[y])) or level_map[y][x] == '#'
+
+
+def _cast(level_map: MapType, visible: RowMask, ox: int, oy: int, radius: int, row: int, start: float,
+          end: float, xx: int, xy: int, yx: int, yy: int) -> None:
+    if start < end:
+        return
+    radius_squared = radius * radius
+    new_start = start
+    for distance in range(row, radius + 1):
+        dy = -distance
+        blocked = False
+        for dx in range(-distance, 1):
+            left_slope, right_slope = (dx - 0.5) / (dy + 0.5), (dx + 0.5) / (dy - 0.5)
+            if start < right_slope:
+                continue
+            if end > left_slope:
+                break
+
+            x, y = ox + dx * xx + dy * xy, oy + dx * yx + dy * yy
+            if dx * dx + dy * dy <= radius_squared and 0 <= y < len(level_map) and 0 <= x < len(level_map[y]):
+                visible[y] = visible.get(y, 0) | (1 << x)
+
+            if blocked:
+                if _blocks(level_map, x, y):
+                    new_start = right_slope
+                else:
+                    blocked = False
+                    start = new_start
+            elif _blocks(level_map, x, y) and distance < radius:
+                # The start of a shadow, whatever is left of it is scanned further out on its own
+                blocked = True
+                _cast(level_map, visible, ox, oy, radius, distance + 1, start, left_slope, xx, xy, yx, yy)
+                new_start = right_slope
+        if blocked:
+            break
+
+
+def compute_fov(level_map: MapType, x: int, y: int, radius: int) -> RowMask:
+    """
+    Find the cells visible from a position with recursive shadowcasting.
+
+    Walls are visible but block the view of what is behind them. Only cells within the radius are visited,
+    so the cost does not depend on the size of the map.
+
+    :param level_map: Map to look at
+    :param x: X coordinate to look from
+    :param y: Y coordinate to look from
+    :param radius: How far can be seen
+    :return: The visible cells
+    """
+    visible: RowMask = {}
+    if 0 <= y < len(level_map) and 0 <= x < len(level_map[y]):
+        visible[y] = 1 << x
+    for xx, xy, yx, yy in _OCTANTS:
+        _cast(level_map, visible, x, y, radius, 1, 1.0, 0.0, xx, xy, yx, yy)
+    return visible
@@ -0,0 +1,92 @@
+import contextlib
+import gc
+import time
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional, Tuple
+
+
+def freeze_startup_objects() -> None:
+    """
+    Move everything alive at startup, like the cutscene art, out of the collector's reach.
+
+    Frozen objects are never traversed again, which shortens every later full collection.
+
+    :return: None
+    """
+    gc.collect()
+    gc.freeze()
+
+
+@contextlib.contextmanager
+def collect_after() -> Iterator[None]:
+    """
+    Suspend automatic collection for the duration of the context and collect once at its end.
+
+    Used around level transitions so the garbage of the old level is collected while the screen changes,
+    instead of in the middle of the next level.
+
+    :return: Context manager
+    """
+    was_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        yield
+    finally:
+        gc.collect()
+        if was_enabled:
+            gc.enable()
+
+
+class GCPauseMonitor(object):
+    """Measures garbage collector pauses with gc.callbacks"""
+
+    def __init__(self):
+        self._started: Optional[float] = None
+        self.pauses: List[Tuple[int, float]] = []  # Generation and duration of the pauses in the current tick
+        self.ticks = 0
+        self.count: Dict[int, int] = defaultdict(int)
+        self.total: Dict[int, float] = defaultdict(float)
+        self.longest: Dict[int, float] = defaultdict(float)
+
+    def __enter__(self) -> 'GCPauseMonitor':
+        gc.callbacks.append(self._callback)
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        gc.callbacks.remove(self._callback)
+
+    def _callback(self, phase: str, info: Dict[str, int]) -> None:
+        if phase == 'start':
+            self._started = time.perf_counter()
+        elif self._started is not None:
+            generation = info['generation']
+            duration = time.perf_counter() - self._started
+            self._started = None
+            self.pauses.append((generation, duration))
+            self.count[generation] += 1
+            self.total[generation] += duration
+            self.longest[generation] = max(self.longest[generation], duration)
+
+    def end_tick(self) -> List[Tuple[int, float]]:
+        """
+        Finish the current tick.
+
+        :return: Generation and duration of every pause during the tick
+        """
+        pauses, self.pauses = self.pauses, []
+        self.ticks += 1
+        return pauses
+
+    def summary(self) -> str:
+        """
+        Summarize the pauses seen so far.
+
+        :return: Human readable summary per generation
+        """
+        lines = [f'GC pauses over {self.ticks} ticks']
+        for generation in sorted(self.count):
+            lines.append(
+                f'  gen{generation}: {self.count[generation]} pauses, '
+                f'{self.total[generation] * 1000:.2f}ms total, longest {self.longest[generation] * 1000:.2f}ms'
+            )
+        return '\n'.join(lines)
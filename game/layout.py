@@ -0,0 +1,183 @@
+import dataclasses
+import math
+import signal
+import textwrap
+import threading
+import weakref
+from typing import Callable, Dict, Hashable, List, Optional, Tuple
+
+from blessed import Terminal
+
+from game.components import Ascii, Text
+
+# Layouts kept per terminal, its layouts start over beyond this
+MAX_LAYOUTS = 256
+
+# Bumped by the SIGWINCH handler, a cache whose size is from an earlier count asks the terminal again
+_resizes = 0
+_watching = False
+
+
+def _on_resize(signum: int, frame: object) -> None:
+    global _resizes
+    _resizes += 1
+
+
+def watch_resizes() -> bool:
+    """
+    Track terminal resizes, so layouts only ask the terminal for its size after one.
+
+    Signal handlers can only be installed from the main thread, without one the size is asked for every frame.
+
+    :return: Whether resizes are tracked
+    """
+    global _watching
+    if _watching:
+        return True
+    if not hasattr(signal, 'SIGWINCH') or threading.current_thread() is not threading.main_thread():
+        return False
+    previous = signal.getsignal(signal.SIGWINCH)
+
+    def handler(signum: int, frame: object) -> None:
+        _on_resize(signum, frame)
+        if callable(previous):
+            previous(signum, frame)
+
+    signal.signal(signal.SIGWINCH, handler)
+    _watching = True
+    return True
+
+
+@dataclasses.dataclass
+class Layout(object):
+    """Where the lines of a Text or Ascii component go on a terminal of a given size"""
+
+    lines: List[Tuple[int, int, str]]  # x, y and text of each line
+    style: Callable[[str], str]
+    # The lines moved to, styled and padded to the full width of the terminal, ready to be echoed
+    rendered: str
+
+
+class _TerminalLayouts(object):
+    """Layouts made for one terminal, and the size they were made for"""
+
+    def __init__(self):
+        self.size: Optional[Tuple[int, int]] = None
+        self.resizes = -1  # Value of _resizes when the size was last asked for
+        self.layouts: Dict[Hashable, Layout] = {}
+
+
+class LayoutCache(object):
+    """
+    Lays out Text and Ascii components, once for every content and terminal size.
+
+    Steady frames only pay for building a key and looking it up. Layouts are kept per terminal, so a server
+    ticking many sessions one after another doesn't throw them away between sessions, and dropped when a terminal
+    changes size, which is only checked after a SIGWINCH if watch_resizes was called.
+    """
+
+    def __init__(self):
+        # Terminals that are gone take their layouts with them
+        self._terminals: 'weakref.WeakKeyDictionary[Terminal, _TerminalLayouts]' = weakref.WeakKeyDictionary()
+        self.misses = 0
+
+    def _for(self, term: Terminal) -> _TerminalLayouts:
+        state = self._terminals.get(term)
+        if state is None:
+            state = self._terminals[term] = _TerminalLayouts()
+        if state.resizes != _resizes or not _watching:
+            size = (term.width, term.height)
+            if size != state.size:
+                state.size = size
+                state.layouts.clear()
+            state.resizes = _resizes
+        return state
+
+    def size(self, term: Terminal) -> Tuple[int, int]:
+        """
+        Size of the terminal, remembered until it is resized.
+
+        :param term: Terminal to measure
+        :return: Width and height
+        """
+        return self._for(term).size
+
+    def clear(self) -> None:
+        """
+        Forget every layout.
+
+        :return: None
+        """
+        self._terminals.clear()
+
+    def text(self, term: Terminal, text: Text) -> Layout:
+        """
+        Lay out a Text component, captions wider than the terminal are wrapped onto several lines.
+
+        :param term: Terminal to lay out for
+        :param text: Component to lay out
+        :return: The layout
+        """
+        key = (Text, text.text_string, text.fg_color, text.bg_color, text.v_align, text.h_align)
+        state = self._for(term)
+        width, height = state.size
+        layout = state.layouts.get(key)
+        if layout is None:
+            rows = textwrap.wrap(text.text_string, width) or [text.text_string]
+            if text.v_align == Text.VerticalAlign.CENTER:
+                top = height // 2 - (len(rows) - 1) // 2
+            elif text.v_align == Text.VerticalAlign.BOTTOM:
+                top = height - len(rows)
+            else:
+                top = 0
+            layout = self._store(state, key, term, f'{text.fg_color}_{text.bg_color}', top, rows, text.h_align)
+        return layout
+
+    def ascii(self, term: Terminal, art: Ascii) -> Layout:
+        """
+        Lay out an Ascii component, centered on the terminal.
+
+        :param term: Terminal to lay out for
+        :param art: Component to lay out
+        :return: The layout
+        """
+        lines = tuple(art.art or ())
+        key = (Ascii, lines, art.fg_color, art.bg_color)
+        state = self._for(term)
+        _, height = state.size
+        layout = state.layouts.get(key)
+        if layout is None:
+            top = height // 2 - len(lines) // 2
+            layout = self._store(state, key, term, f'{art.fg_color}_{art.bg_color}', top, list(lines),
+                                 Text.HorizontalAlign.CENTER)
+        return layout
+
+    def _store(self, state: _TerminalLayouts, key: Hashable, term: Terminal, color: str, top: int, rows: List[str],
+               h_align: Text.HorizontalAlign) -> Layout:
+        self.misses += 1
+        width, height = state.size
+        style = getattr(term, color)
+        lines = []
+        rendered = []
+        for y, row in enumerate(rows, top):
+            if not 0 <= y < height:
+                continue
+            # Measured the way blessed does, wide characters take two columns
+            space = max(0, width - term.length(row))
+            if h_align == Text.HorizontalAlign.CENTER:
+                left, right = math.floor(space / 2), math.ceil(space / 2)
+            elif h_align == Text.HorizontalAlign.RIGHT:
+                left, right = space, 0
+            else:
+                left, right = 0, space
+            lines.append((left, y, row))
+            rendered.append(term.move_xy(0, y) + ' ' * left + style(row) + ' ' * right)
+
+        if len(state.layouts) >= MAX_LAYOUTS:
+            state.layouts.clear()
+        layout = state.layouts[key] = Layout(lines=lines, style=style, rendered=''.join(rendered))
+        return layout
+
+
+# Shared by the renderers, whichever terminal they draw on
+layout_cache = LayoutCache()
@@ -0,0 +1,117 @@
+import argparse
+import asyncio
+import dataclasses
+import json
+import random
+import statistics
+import time
+from typing import List, Optional
+
+from game.utils import FRAME_MARKER_PREFIX
+
+MOVE_KEYS = (b'w', b'a', b's', b'd')
+
+
+@dataclasses.dataclass
+class ClientResult(object):
+    """What a single load test client saw"""
+
+    admitted: bool = False
+    frames: int = 0
+    bytes_received: int = 0
+    connected_for: float = 0.0
+    disconnected_early: bool = False
+
+    @property
+    def fps(self) -> float:
+        """Frames received per second"""
+        return self.frames / self.connected_for if self.connected_for > 0 else 0.0
+
+
+async def _client(host: str, port: int, duration: float, key_rate: float) -> ClientResult:
+    result = ClientResult()
+    try:
+        reader, writer = await asyncio.open_connection(host, port)
+    except OSError:
+        return result
+
+    marker = FRAME_MARKER_PREFIX.encode('utf-8')
+    start = time.monotonic()
+    next_key = start
+    try:
+        while time.monotonic() - start < duration:
+            try:
+                data = await asyncio.wait_for(reader.read(65536), timeout=0.5)
+            except asyncio.TimeoutError:
+                continue
+            if not data:
+                result.disconnected_early = result.admitted
+                break
+            if not result.admitted and b'Server full' in data:
+                break
+            result.admitted = True
+            result.bytes_received += len(data)
+            result.frames += data.count(marker)
+
+            if time.monotonic() >= next_key:
+                writer.write(random.choice(MOVE_KEYS))
+                next_key += 1 / key_rate
+    except ConnectionError:
+        result.disconnected_early = result.admitted
+    finally:
+        result.connected_for = time.monotonic() - start
+        writer.close()
+    return result
+
+
+async def _load_test(host: str, port: int, sessions: int, ramp: float, duration: float,
+                     key_rate: float) -> List[ClientResult]:
+    clients = []
+    for i in range(sessions):
+        clients.append(asyncio.ensure_future(_client(host, port, duration, key_rate)))
+        await asyncio.sleep(ramp / sessions)
+    return await asyncio.gather(*clients)
+
+
+def summarize(results: List[ClientResult], target_fps: float) -> dict:
+    """
+    Summarize a load test.
+
+    :param results: Results of every client
+    :param target_fps: Frame rate a session must keep to count as held
+    :return: Dictionary of aggregate statistics
+    """
+    admitted = [r for r in results if r.admitted]
+    fps = [r.fps for r in admitted]
+    longest = max((r.connected_for for r in results), default=0.0)
+    return {
+        'sessions': len(results),
+        'admitted': len(admitted),
+        'rejected': len(results) - len(admitted),
+        'dropped': sum(r.disconnected_early for r in admitted),
+        # Sessions that kept 90% of the target frame rate for the whole test
+        'held': sum(1 for r in admitted if not r.disconnected_early and r.fps >= 0.9 * target_fps),
+        'fps_median': statistics.median(fps) if fps else 0.0,
+        'fps_min': min(fps) if fps else 0.0,
+        'bytes_per_second': sum(r.bytes_received for r in admitted) / longest if longest > 0 else 0.0,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Entrypoint for the load test client, run it against a server started with --frame-marker"""
+    parser = argparse.ArgumentParser(description='Load test a Dedicated Dugongs server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=2323)
+    parser.add_argument('--sessions', type=int, default=100)
+    parser.add_argument('--ramp', type=float, default=5.0, help='Seconds over which to open the sessions')
+    parser.add_argument('--duration', type=float, default=20.0, help='Seconds each session stays connected')
+    parser.add_argument('--key-rate', type=float, default=5.0, help='Keys sent per second per session')
+    parser.add_argument('--target-fps', type=float, default=10.0)
+    args = parser.parse_args(argv)
+
+    results = asyncio.run(_load_test(args.host, args.port, args.sessions, args.ramp, args.duration, args.key_rate))
+    print(json.dumps(summarize(results, args.target_fps), indent=2))
+
+
+if __name__ == '__main__':
+    main()
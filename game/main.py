@@ -1,25 +1,194 @@
+import argparse
+import contextlib
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
 from blessed import Terminal
 
-from game.state import Intro
+from game.asciicast import AsciicastRecorder, Backpressure
+from game.gcmonitor import (
+    GCPauseMonitor, collect_after, freeze_startup_objects
+)
+from game.layout import watch_resizes
+from game.memory import MemoryMonitor
+from game.recording import SessionHeader, SessionRecorder, replay_session
+from game.spectate import FrameCapture, SpectatorBroadcaster
+from game.split import run_split
+from game.state import Intro, endless_progression
+from game.utils import echo, frame_marker, output_to
+
 
+def _parse_args(argv: Optional[List[str]] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Dedicated Dugongs')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for the random number generator')
+    parser.add_argument('--record', metavar='PATH', default=None, help='Record the session to a file')
+    parser.add_argument('--replay', metavar='PATH', default=None, help='Replay a recorded session headlessly')
+    parser.add_argument(
+        '--no-verify', action='store_true', help='Skip comparing state hashes when replaying'
+    )
+    parser.add_argument(
+        '--threads', type=int, default=0, help='Run independent processors concurrently on this many threads'
+    )
+    parser.add_argument(
+        '--memory-report', metavar='PATH', default=None, help='Periodically append a memory report to a file'
+    )
+    parser.add_argument(
+        '--memory-interval', type=float, default=10.0, help='Seconds between memory reports'
+    )
+    parser.add_argument(
+        '--gc-stats', metavar='PATH', default=None, help='Append garbage collector pauses per tick to a file'
+    )
+    parser.add_argument(
+        '--split', action='store_true',
+        help='Simulate in a separate process from rendering, so a slow terminal does not slow the game down'
+    )
+    parser.add_argument(
+        '--spectate', metavar='PORT', type=int, default=None, help='Let spectators watch the game on this port'
+    )
+    parser.add_argument(
+        '--asciicast', metavar='PATH', default=None, help='Record what the terminal shows to a gzip asciicast file'
+    )
+    parser.add_argument(
+        '--asciicast-policy', choices=[policy.value for policy in Backpressure], default=Backpressure.COALESCE.value,
+        help='What to do with frames when writing the asciicast falls behind'
+    )
+    parser.add_argument(
+        '--endless', action='store_true', help='Play levels generated as they are played, in constant memory'
+    )
+    parser.add_argument(
+        '--level-rows', type=int, default=None, help='Rows of every endless level, they never end without it'
+    )
+    parser.add_argument(
+        '--frame-marker', action='store_true', help='End every frame with a marker naming the screen, for harnesses'
+    )
+    args = parser.parse_args(argv)
+    if args.endless and args.split:
+        # The simulation hands the render process the whole map, which an endless one doesn't have
+        parser.error('--endless can not be combined with --split')
+    return args
 
-def main() -> None:
+
+def main(argv: Optional[List[str]] = None) -> None:
     """Entrypoint for the game"""
+    args = _parse_args(argv)
+
+    if args.replay is not None:
+        result = replay_session(args.replay, verify=not args.no_verify)
+        print(
+            f'Replayed {result.ticks} ticks in {result.elapsed:.3f}s '
+            f'({result.ticks_per_second:.0f} ticks/s), {result.verified} states verified'
+        )
+        return
+
     term = Terminal()
+    # Layouts of texts and art are kept until the terminal is resized
+    watch_resizes()
+
+    if args.split:
+        stats = run_split(term, args.seed)
+        print(
+            f'Simulated {stats.ticks} ticks in {stats.elapsed:.1f}s ({stats.ticks_per_second:.1f} ticks/s), '
+            f'longest tick {stats.longest_tick * 1000:.0f}ms'
+        )
+        return
 
     speed = 1 / 10
     inp = None
 
-    level = Intro()
-    level.setup(term)
+    seed = args.seed
+    if seed is None and args.record is not None:
+        seed = random.randrange(1 << 32)
+    if seed is not None:
+        random.seed(seed)
+
+    asciicast = None
+    with contextlib.ExitStack() as stack:
+        recorder = None
+        if args.record is not None:
+            recorder = stack.enter_context(
+                SessionRecorder(args.record, SessionHeader(
+                    seed=seed, width=term.width, height=term.height, endless=args.endless, level_rows=args.level_rows
+                ))
+            )
+
+        memory, memory_file = None, None
+        if args.memory_report is not None:
+            memory, memory_file = MemoryMonitor(), stack.enter_context(open(args.memory_report, 'a'))
+
+        gc_monitor, gc_file = None, None
+        if args.gc_stats is not None:
+            gc_file = stack.enter_context(open(args.gc_stats, 'a'))
+            gc_monitor = stack.enter_context(GCPauseMonitor())
+            stack.callback(lambda: gc_file.write(gc_monitor.summary() + '\n'))
+
+        broadcaster, capture = None, None
+        if args.spectate is not None:
+            broadcaster = stack.enter_context(
+                SpectatorBroadcaster(port=args.spectate, width=term.width, height=term.height)
+            )
+        if args.asciicast is not None:
+            asciicast = stack.enter_context(AsciicastRecorder(
+                args.asciicast, width=term.width, height=term.height, policy=Backpressure(args.asciicast_policy)
+            ))
+        if broadcaster is not None or asciicast is not None:
+            capture = FrameCapture(sys.stdout)
+            stack.enter_context(output_to(capture))
+
+        executor = None
+        if args.threads > 0:
+            executor = stack.enter_context(ThreadPoolExecutor(args.threads))
+
+        level = Intro(endless_progression(args.level_rows) if args.endless else None)
+        level.world.executor = executor
+        level.setup(term)
+        if memory is not None:
+            memory.screen_changed(type(level).__name__)
+        # Everything loaded so far lives for the whole game
+        freeze_startup_objects()
+
+        last_tick = time.monotonic()
+        with term.hidden_cursor(), term.cbreak(), term.location():
+            while inp not in (u'q', u'Q'):
+                now = time.monotonic()
+                dt, last_tick = now - last_tick, now
+
+                next_level = level.tick(term, dt, inp)
+                if args.frame_marker:
+                    echo(frame_marker(type(level).__name__))
+                if capture is not None:
+                    output = capture.take()
+                    if broadcaster is not None:
+                        broadcaster.publish(output)
+                    if asciicast is not None:
+                        asciicast.record(output)
+                if recorder is not None:
+                    recorder.record(dt, inp, level.world)
+                if next_level is not None:
+                    with collect_after():
+                        level.teardown()
+                        level = next_level
+                        level.world.executor = executor
+                        level.setup(term)
+                    if memory is not None:
+                        memory.screen_changed(type(level).__name__)
+                if memory is not None:
+                    memory.maybe_dump(memory_file, args.memory_interval, level.world, getattr(level, 'level', None))
+                if gc_monitor is not None:
+                    for generation, duration in gc_monitor.end_tick():
+                        gc_file.write(f'tick {gc_monitor.ticks}: gen{generation} pause {duration * 1000:.2f}ms\n')
+                inp = term.inkey(timeout=speed)
 
-    with term.hidden_cursor(), term.cbreak(), term.location():
-        while inp not in (u'q', u'Q'):
-            next_level = level.tick(term, 0.0, inp)
-            if next_level is not None:
-                level = next_level
-                level.setup(term)
-            inp = term.inkey(timeout=speed)
+    if asciicast is not None:
+        stats = asciicast.stats
+        print(
+            f'Recorded {stats.frames} frames to {args.asciicast}, {stats.dropped} dropped, {stats.coalesced} '
+            f'coalesced, {stats.overhead_per_frame * 1e6:.0f}us per frame on the game thread'
+        )
+        if asciicast.error is not None:
+            print(f'Writing the recording failed: {asciicast.error}')
 
 
 if __name__ == '__main__':
@@ -1,34 +1,57 @@
+import dataclasses
+import itertools
 import random
-from typing import List, Tuple
+import time
+from typing import Iterator, List, Optional, Tuple
 
 MapType = List[List[str]]
 
+# Maps generated again when one can't be finished, before a way through is carved instead
+MAX_RETRIES = 3
 
-def mapgenerator(map_width: int, map_height: int, room_frequency: int, room_size: int, path_width: int) -> \
-        Tuple[MapType, int]:
+# Turns a row into a binary number, least significant bit last
+_OPEN_BITS = str.maketrans({'#': '0', ' ': '1'})
+
+
+@dataclasses.dataclass
+class MapReport(object):
+    """How a level came out of generate_level"""
+
+    seconds: float = 0.0  # Spent generating and validating
+    retries: int = 0  # Maps thrown away for not connecting the spawn to the exit
+    repaired: bool = False  # Whether a way through had to be carved after running out of retries
+    critical_path: int = 0  # Fewest moves from the spawn to leaving through the bottom of the map
+
+
+def map_rows(map_width: int, room_frequency: int, room_size: int, path_width: int,
+             rng: Optional[random.Random] = None) -> Tuple[int, Iterator[List[str]]]:
     """
-    Generate a map
+    Start generating a map row by row, for as long as rows are taken.
+
+    The path and the room being carved carry over from row to row, so rows taken in several goes make up the
+    same continuous map as rows taken at once.
 
     :param map_width: Width of the map
-    :param map_height: Height of the map
     :param room_frequency: Frequency of rooms generated in the map
     :param room_size: Size of rooms in the map
     :param path_width: Average width of path
-    :return: A tuple containing the map and a x-coordinate spawn location for the player
+    :param rng: Random number generator to use, the random module by default
+    :return: A tuple containing a x-coordinate spawn location for the player and an endless iterator of rows
     """
+    rng = rng or random
+    x = rng.randrange(3, 47 + map_width)
+    return x, _path_rows(rng, x, map_width, room_frequency, room_size, path_width)
+
+
+def _path_rows(rng: random.Random, x: int, z: int, room_frequency: int, level: int,
+               path_width: int) -> Iterator[List[str]]:
     t = 0
-    i = 0
-    j = []
-    z = map_width
-    level = room_size
-    x = random.randrange(3, 47 + z)
-    original_spawn = x
-    while i in range(0, map_height):
-        i += 1
+    v: List[int] = []
+    while True:
         k = 0
 
         m = []
-        vb = random.randrange(1, room_frequency)
+        vb = rng.randrange(1, room_frequency)
 
         while k in range(0, 50 + z):
             k += 1
@@ -38,33 +61,33 @@ def mapgenerator(map_width: int, map_height: int, room_frequency: int, room_size
             else:
                 m.append('#')
         if x < 7:
-            r = x + (random.randrange(0, (path_width // 2) - 1))
+            r = x + (rng.randrange(0, (path_width // 2) - 1))
             x = r
         elif x > 43:
-            r = x + (random.randrange(-((path_width // 2) - 1), 0))
+            r = x + (rng.randrange(-((path_width // 2) - 1), 0))
             x = r
         else:
-            r = x + (random.randrange(-((path_width // 2) - 1), (path_width // 2) - 1))
+            r = x + (rng.randrange(-((path_width // 2) - 1), (path_width // 2) - 1))
             x = r
-        vb = random.randrange(1, room_frequency)
-        if x < level + 2 and vb == random.randrange(1, room_frequency):
+        vb = rng.randrange(1, room_frequency)
+        if x < level + 2 and vb == rng.randrange(1, room_frequency):
             t = 0
             v = []
             while t < (level):
                 t += 1
                 m[x + t] = ' '
                 v.append(x + t)
-        elif x > z + 48 - level and vb == random.randrange(1, room_frequency):
+        elif x > z + 48 - level and vb == rng.randrange(1, room_frequency):
             t = 0
             v = []
             while t < (level):
                 t += 1
                 m[x - t] = ' '
                 v.append(x - t)
-        elif z + 48 - level > x > level + 2 and vb == random.randrange(1, room_frequency):
+        elif z + 48 - level > x > level + 2 and vb == rng.randrange(1, room_frequency):
             t = 0
             v = []
-            e = random.randint(0, 1)
+            e = rng.randint(0, 1)
             if e == 1:
                 while t < (level):
                     t += 1
@@ -80,5 +103,116 @@ def mapgenerator(map_width: int, map_height: int, room_frequency: int, room_size
                 m[q] = ' '
             t -= 1
 
-        j.append(m)
-    return j, original_spawn
+        yield m
+
+
+def mapgenerator(map_width: int, map_height: int, room_frequency: int, room_size: int, path_width: int) -> \
+        Tuple[MapType, int]:
+    """
+    Generate a map
+
+    :param map_width: Width of the map
+    :param map_height: Height of the map
+    :param room_frequency: Frequency of rooms generated in the map
+    :param room_size: Size of rooms in the map
+    :param path_width: Average width of path
+    :return: A tuple containing the map and a x-coordinate spawn location for the player
+    """
+    original_spawn, rows = map_rows(map_width, room_frequency, room_size, path_width)
+    return list(itertools.islice(rows, map_height)), original_spawn
+
+
+def _open_cells(level_map: MapType) -> Tuple[int, int]:
+    """
+    Pack the open cells of a map into a single int.
+
+    Rows are a stride apart, which leaves a closed bit between them so shifting a row sideways never spills
+    into the next one.
+
+    :return: The open cells, the bit of a cell is y * stride + x, and the stride
+    """
+    stride = len(level_map[0]) + 1
+    bits = ''.join('0' + ''.join(row).translate(_OPEN_BITS)[::-1] for row in reversed(level_map))
+    return int(bits, 2), stride
+
+
+def _flood(level_map: MapType, spawn: int) -> Tuple[int, Optional[int]]:
+    """
+    Flood fill the open cells reachable from the spawn, a step in every direction at once.
+
+    Each step grows every reached cell into its neighbours with a handful of shifts over the whole map, so the
+    step the exit row is first reached on is the length of the shortest way there.
+
+    :return: The reached cells, and the fewest moves that leave the map through the bottom, None if none do
+    """
+    open_cells, stride = _open_cells(level_map)
+    exit_row = ((1 << (stride - 1)) - 1) << (stride * (len(level_map) - 1))
+    reached = (1 << spawn) & open_cells
+    steps = 0
+    while reached:
+        if reached & exit_row:
+            # And one more to step off the bottom row
+            return reached, steps + 1
+        grown = (reached | reached << 1 | reached >> 1 | reached << stride | reached >> stride) & open_cells
+        if grown == reached:
+            break
+        reached, steps = grown, steps + 1
+    return reached, None
+
+
+def critical_path(level_map: MapType, spawn: int) -> Optional[int]:
+    """
+    Find how many moves it takes at least to get from the spawn to the exit.
+
+    :param level_map: Map to check
+    :param spawn: X coordinate on the top row the player starts at
+    :return: Fewest moves to leave through the bottom of the map, None if the player can't get there
+    """
+    return _flood(level_map, spawn)[1]
+
+
+def _carve_exit(level_map: MapType, spawn: int) -> None:
+    """Carve a corridor straight down from the lowest cell reachable from the spawn"""
+    reached, _ = _flood(level_map, spawn)
+    if not reached:
+        x, y = spawn, 0
+    else:
+        stride = len(level_map[0]) + 1
+        y = (reached.bit_length() - 1) // stride
+        x = ((reached >> (y * stride)) & ((1 << stride) - 1)).bit_length() - 1
+    for row in level_map[y:]:
+        row[x] = ' '
+
+
+def generate_level(map_width: int, map_height: int, room_frequency: int, room_size: int, path_width: int,
+                   max_retries: int = MAX_RETRIES) -> Tuple[MapType, int, MapReport]:
+    """
+    Generate a map that can be finished.
+
+    Maps whose exit can't be reached from the spawn are generated again, and once out of retries a corridor
+    is carved from as far as the player can get down to the bottom.
+
+    :param map_width: Width of the map
+    :param map_height: Height of the map
+    :param room_frequency: Frequency of rooms generated in the map
+    :param room_size: Size of rooms in the map
+    :param path_width: Average width of path
+    :param max_retries: Maps to generate again before repairing the last one
+    :return: A tuple containing the map, a x-coordinate spawn location for the player and how the map came to be
+    """
+    start = time.perf_counter()
+    report = MapReport()
+    while True:
+        level_map, spawn = mapgenerator(map_width, map_height, room_frequency, room_size, path_width)
+        path = critical_path(level_map, spawn)
+        if path is not None or report.retries == max_retries:
+            break
+        report.retries += 1
+
+    if path is None:
+        _carve_exit(level_map, spawn)
+        path = critical_path(level_map, spawn)
+        report.repaired = True
+    report.critical_path = path
+    report.seconds = time.perf_counter() - start
+    return level_map, spawn, report
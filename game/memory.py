@@ -0,0 +1,129 @@
+import sys
+import time
+import tracemalloc
+from collections import deque
+from typing import Deque, Dict, List, Optional, TextIO, Tuple
+
+from game.cutscenes import ordered_cutscenes
+from game.ecs.world import World
+from game.mapgeneration import MapType
+
+# How many allocation sites to list for each transition
+TOP_SITES = 5
+# Transitions kept for the report, older ones only count towards the totals
+MAX_TRANSITIONS = 32
+
+
+def map_bytes(level_map: MapType) -> int:
+    """
+    Estimate the memory held by a level map.
+
+    :param level_map: Map to measure
+    :return: Bytes used by the rows and their cells
+    """
+    size = sys.getsizeof(level_map)
+    cells = set()
+    for row in level_map:
+        size += sys.getsizeof(row)
+        cells.update(row)
+    # Cells are single character strings, which Python shares, so every distinct one is counted once
+    return size + sum(sys.getsizeof(cell) for cell in cells)
+
+
+def cutscene_bytes() -> int:
+    """
+    Estimate the memory held by the cutscene art and captions.
+
+    :return: Bytes used by every frame of every cutscene
+    """
+    seen = set()
+    size = sys.getsizeof(ordered_cutscenes)
+    for sequence in ordered_cutscenes:
+        size += sys.getsizeof(sequence)
+        for art, _, text in sequence:
+            # Art is shared between sequences, only count it once
+            for obj in (art, text, *art):
+                if id(obj) not in seen:
+                    seen.add(id(obj))
+                    size += sys.getsizeof(obj)
+    return size
+
+
+class MemoryMonitor(object):
+    """Tracks memory across screen setups and level transitions using tracemalloc"""
+
+    def __init__(self, frames: int = 1, max_transitions: int = MAX_TRANSITIONS):
+        tracemalloc.start(frames)
+        self.snapshot: Optional[tracemalloc.Snapshot] = None
+        # Bounded, so endless play doesn't grow the monitor's own memory
+        self.transitions: Deque[Tuple[str, int, List[tracemalloc.StatisticDiff]]] = deque(maxlen=max_transitions)
+        self.transition_count = 0
+        self.total_growth = 0
+        self.last_report = time.monotonic()
+
+    def screen_changed(self, screen_name: str) -> None:
+        """
+        Take a snapshot once a screen has been set up and compare it with the one taken after the previous screen.
+
+        Memory that keeps growing from one screen to the next is left behind by earlier screens.
+
+        :param screen_name: Name of the screen that was just set up
+        :return: None
+        """
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+        ))
+        if self.snapshot is not None:
+            diff = snapshot.compare_to(self.snapshot, 'lineno')
+            growth = sum(stat.size_diff for stat in diff)
+            self.transitions.append((screen_name, growth, diff[:TOP_SITES]))
+            self.transition_count += 1
+            self.total_growth += growth
+        self.snapshot = snapshot
+
+    def report(self, world: World, level_map: Optional[MapType] = None) -> str:
+        """
+        Build a report of the current memory use.
+
+        :param world: World of the current screen
+        :param level_map: Map of the current level, if there is one
+        :return: Human readable report
+        """
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f'Traced memory: {current / 1024:.1f} KiB, peak {peak / 1024:.1f} KiB']
+
+        stats: Dict[str, Dict[str, int]] = world.memory_stats()
+        lines.append(f'World: {sum(s["bytes"] for s in stats.values()) / 1024:.1f} KiB')
+        for name, stat in sorted(stats.items(), key=lambda item: -item[1]['bytes']):
+            lines.append(f'  {name}: {stat["count"]} using {stat["bytes"]} bytes')
+
+        if level_map is not None:
+            lines.append(f'Map: {map_bytes(level_map) / 1024:.1f} KiB')
+        lines.append(f'Cutscene assets: {cutscene_bytes() / 1024:.1f} KiB')
+
+        if self.transition_count:
+            lines.append(
+                f'Transitions: {self.transition_count}, {self.total_growth / 1024:+.1f} KiB in total, '
+                f'the last {len(self.transitions)}:'
+            )
+        for screen_name, growth, sites in self.transitions:
+            lines.append(f'Transition to {screen_name}: {growth / 1024:+.1f} KiB')
+            for site in sites:
+                lines.append(f'  {site}')
+        return '\n'.join(lines)
+
+    def maybe_dump(self, stream: TextIO, interval: float, world: World, level_map: Optional[MapType] = None) -> None:
+        """
+        Write a report if the interval has passed since the last one.
+
+        :param stream: Stream to write the report to
+        :param interval: Seconds between reports
+        :param world: World of the current screen
+        :param level_map: Map of the current level, if there is one
+        :return: None
+        """
+        now = time.monotonic()
+        if now - self.last_report >= interval:
+            self.last_report = now
+            stream.write(f'--- {time.strftime("%H:%M:%S")} ---\n{self.report(world, level_map)}\n')
+            stream.flush()
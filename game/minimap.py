@@ -0,0 +1,97 @@
+import math
+from typing import Callable, Dict, Iterable, List, Tuple
+
+from game.compositor import Cell, Position
+from game.mapgeneration import MapType
+
+# Largest minimap, in terminal cells
+MAX_COLUMNS = 16
+MAX_ROWS = 8
+
+# Bit of each dot of a braille character, by column and row of the dot
+_BRAILLE_DOTS = {
+    (0, 0): 0x01, (0, 1): 0x02, (0, 2): 0x04, (1, 0): 0x08,
+    (1, 1): 0x10, (1, 2): 0x20, (0, 3): 0x40, (1, 3): 0x80,
+}
+# Braille character for every mask with bit 2 * row + column set for each dot, so masks can be built with shifts
+GLYPHS = tuple(
+    chr(0x2800 + sum(bit for (dx, dy), bit in _BRAILLE_DOTS.items() if mask >> (2 * dy + dx) & 1))
+    for mask in range(256)
+)
+
+# Map characters to a byte per cell, 1 for cells that can be walked on
+_WALKABLE = bytes.maketrans(b'# ', b'\x00\x01')
+
+
+class Minimap(object):
+    """
+    The walkable cells of a whole map shrunk into braille characters.
+
+    Every dot of a character stands for a block of map cells and is set when any of them can be walked on.
+    Each map row becomes an int with a byte per cell, 1 for walkable cells, so or'ing the rows of a dot
+    combines them cell by cell. The cells a dot covers are then picked out of the combined row with strided
+    slices, turned back into ints with a byte per character, shifted onto the bit of their dot and or'ed
+    together. Every character of a row is packed at once that way.
+    """
+
+    def __init__(self, level_map: MapType, max_columns: int = MAX_COLUMNS, max_rows: int = MAX_ROWS):
+        height, width = len(level_map), max(len(row) for row in level_map)
+        # Map cells per dot
+        self.scale_x = max(1, math.ceil(width / (2 * max_columns)))
+        self.scale_y = max(1, math.ceil(height / (4 * max_rows)))
+        self.columns = math.ceil(width / (2 * self.scale_x))
+        block_x, block_y = 2 * self.scale_x, 4 * self.scale_y
+
+        lanes = [int.from_bytes(''.join(row).encode('latin-1').translate(_WALKABLE), 'little') for row in level_map]
+        self.masks: List[bytes] = []
+        for top in range(0, height, block_y):
+            packed = 0
+            for dy in range(4):
+                # The rows of a dot are or'ed first, so only the combined row needs slicing
+                combined = 0
+                for lane in lanes[top + dy * self.scale_y:min(top + (dy + 1) * self.scale_y, height)]:
+                    combined |= lane
+                row = combined.to_bytes(width, 'little')
+                for dx in range(2):
+                    for offset in range(dx * self.scale_x, (dx + 1) * self.scale_x):
+                        packed |= int.from_bytes(row[offset::block_x], 'little') << (2 * dy + dx)
+            self.masks.append(packed.to_bytes(self.columns, 'little'))
+        self.rows = [mask.decode('latin-1').translate(GLYPHS) for mask in self.masks]
+
+    def locate(self, x: int, y: int) -> Tuple[int, int, int]:
+        """
+        Find the dot a map cell is shown as.
+
+        :param x: X coordinate on the map
+        :param y: Y coordinate on the map
+        :return: Column and row of the character, and the mask of the dot
+        """
+        dot_x, dot_y = x // self.scale_x, y // self.scale_y
+        return dot_x // 2, dot_y // 4, 1 << (2 * (dot_y % 4) + dot_x % 2)
+
+    def cells(self, left: int, style: Callable[[str], str]) -> Dict[Position, Cell]:
+        """
+        Lay the minimap out as terminal cells.
+
+        :param left: Terminal column of the first character
+        :param style: Formatting to draw the minimap with
+        :return: Cells by terminal position
+        """
+        return {
+            (left + column, row): (character, style)
+            for row, line in enumerate(self.rows) for column, character in enumerate(line)
+        }
+
+    def marks(self, positions: Iterable[Tuple[int, int]]) -> Dict[Tuple[int, int], str]:
+        """
+        Add the dots of map cells to the characters they fall in.
+
+        :param positions: Map cells to mark
+        :return: The characters with the marked dots set, by column and row
+        """
+        masks: Dict[Tuple[int, int], int] = {}
+        for x, y in positions:
+            column, row, dot = self.locate(x, y)
+            if 0 <= row < len(self.masks) and 0 <= column < self.columns:
+                masks[(column, row)] = masks.get((column, row), self.masks[row][column]) | dot
+        return {position: GLYPHS[mask] for position, mask in masks.items()}
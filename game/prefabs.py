@@ -0,0 +1,20 @@
+from game.components import (
+    FollowAI, Movement, PlayerInput, Renderable, Transform, Vision
+)
+from game.ecs.prefab import Prefab
+from game.utils import Vector2
+
+PLAYER = Prefab('player', {
+    Transform: {},
+    Movement: {'direction': Vector2.RIGHT},
+    PlayerInput: {},
+    Renderable: {'w': 1, 'h': 1, 'character': u'^'},
+    Vision: {'radius': 8},
+})
+
+ENEMY = Prefab('enemy', {
+    Transform: {},
+    Movement: {'direction': Vector2.RIGHT},
+    FollowAI: {},
+    Renderable: {'w': 1, 'h': 1, 'character': u'O'},
+})
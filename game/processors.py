@@ -1,29 +1,46 @@
-import time
+import dataclasses
+import heapq
+import itertools
+from typing import Dict, Iterator, List, Optional, Tuple
 
 from blessed import Terminal
 
+from game.chunkedmap import ChunkedMap
 from game.components import (
-    Ascii, FollowAI, Movement, PlayerInput, Renderable, Text, TimeToLive,
-    Transform
+    Ascii, FollowAI, Movement, PlayerInput, ReachedExit, Renderable, Text,
+    TimeToLive, Transform, Vision
 )
-from game.ecs import ProcessorFunc
-from game.ecs.world import World
+from game.compositor import Cell, Compositor, Layer, Position
+from game.ecs import EntityId, ProcessorFunc
+from game.ecs.scheduler import access
+from game.ecs.world import ComponentChanges, World
+from game.footprint import WallGrid, footprint
+from game.fov import compute_fov
+from game.layout import layout_cache
 from game.mapgeneration import MapType
+from game.minimap import Minimap
 from game.utils import Vector2, echo
 
 
 def movement_processor(current_map: MapType) -> ProcessorFunc:
-    """Returns a processor that handles movement for the given map"""
+    """Returns a processor that handles movement for the given map, blocking every cell an entity's sprite covers"""
+    walls = WallGrid(current_map)
 
+    @access(reads=(Renderable,), writes=(Transform, Movement, ReachedExit))
     def movement(term: Terminal, world: World, dt: float, inp: str) -> None:
-        position_components = world.get_components(Transform)
+        position_components = world.view(Transform)
         for transform in position_components:
             movement = world.get_component(transform.entity, Movement)
             if movement is not None:
                 movement.last_position = transform.position
                 next_pos = transform.position + movement.direction
+                renderable = world.get_component(transform.entity, Renderable)
+                shape = footprint(renderable.w, renderable.h) if renderable is not None else footprint(1, 1)
 
-                if (current_map[next_pos.y])[next_pos.x] == '#':
+                if next_pos.y >= len(current_map):
+                    # Stepping off the bottom of the map is the way out of the level
+                    world.commands.add(transform.entity, ReachedExit())
+                elif walls.blocks(shape, next_pos.x, next_pos.y):
                     movement.last_position = transform.position
                 else:
                     transform.position = transform.position + movement.direction
@@ -33,43 +50,113 @@ def movement_processor(current_map: MapType) -> ProcessorFunc:
 
 def render_system(level_map: MapType) -> ProcessorFunc:
     """Returns a processor that renders entities on the given map"""
-
+    compositor: Optional[Compositor] = None
+    sprites = Layer(z=1, masked=True)
+    texts = Layer(z=2, fixed=True)
+    # Packed once for the level, only the dots of the entities change from frame to frame
+    minimap = None if isinstance(level_map, ChunkedMap) else Minimap(level_map)
+    overview = Layer(z=3, fixed=True)
+    overview_left: Optional[int] = None
+    overview_static: Dict[Position, Cell] = {}
+
+    @access(reads=(Renderable, Transform, Text, Vision, PlayerInput), writes=(Terminal,))
     def _renderer(term: Terminal, world: World, dt: float, inp: str) -> None:
-        color_bg = term.on_blue
-        color_worm = term.yellow_reverse
-        # Blank the screen
-        echo(term.move_yx(1, 1))
-        echo(color_bg(term.clear))
-
-        # Draw the current map
-        for row in level_map:
-            print(term.orangered_on_blue(''.join(row)))
+        nonlocal compositor, overview_left, overview_static
+        if compositor is None:
+            # The map never changes during a level, the compositor renders it once and keeps it
+            compositor = Compositor(level_map, term.orangered_on_blue, term.on_blue, term.darkorange4_on_blue)
+            compositor.add_layer(sprites)
+            compositor.add_layer(texts)
+            compositor.add_layer(overview)
+            exposed['compositor'] = compositor
+
+        # Only what the player sees, or has seen, of the map is drawn, and the view scrolls along with the player
+        for vision in world.view(Vision):
+            compositor.reveal(vision.visible, vision.seen)
+            if vision.origin is not None:
+                compositor.follow(vision.origin[1], term.height)
 
         # Draw the Renderable components
-        renderable_components = world.get_components(Renderable)
-        for component in renderable_components:
-            transform = world.get_component(component.entity, Transform)
-            movement = world.get_component(component.entity, Movement)
-
-            # Clear the old position
-            if movement is not None and movement.last_position is not None:
-                echo(term.move_xy(*movement.last_position))
-                for i in range(component.h):
-                    echo(color_bg(u' ' * component.w))
-                    echo(term.move_xy(*(movement.last_position + Vector2(0, -(i + 1)))))
-
-            # Draw the new position
-            echo(term.move_xy(*transform.position))
+        color_worm = term.yellow_reverse
+        sprites.cells.clear()
+        for component in world.view(Renderable):
+            x, y = world.get_component(component.entity, Transform).position
             for i in range(component.h):
-                echo(color_worm(component.character * component.w))
-                echo(term.move_xy(*(transform.position + Vector2(0, -(i + 1)))))
-
+                for dx in range(component.w):
+                    sprites.cells[(x + dx, y - i)] = (component.character, color_worm)
+
+        texts.cells.clear()
+        for text in world.view(Text):
+            layout = layout_cache.text(term, text)
+            for x, y, line in layout.lines:
+                for dx, character in enumerate(line):
+                    texts.cells[(x + dx, y)] = (character, layout.style)
+
+        if minimap is not None:
+            if overview_left != term.width - minimap.columns:
+                # In the top right corner, if the terminal is wide enough
+                overview_left = term.width - minimap.columns
+                overview_static = minimap.cells(overview_left, term.white_on_black) if overview_left > 0 else {}
+            overview.cells = dict(overview_static)
+            if overview_static:
+                players = [
+                    world.get_component(player.entity, Transform).position for player in world.view(PlayerInput)
+                ]
+                others = [
+                    world.get_component(component.entity, Transform).position for component in world.view(Renderable)
+                    if world.get_component(component.entity, PlayerInput) is None
+                ]
+                # Players are drawn last, so a character holding both is in the player's colour
+                for positions, style in ((others, term.red_on_black), (players, term.bold_yellow_on_black)):
+                    for (column, row), character in minimap.marks(positions).items():
+                        overview.cells[(overview_left + column, row)] = (character, style)
+
+        echo(compositor.render(term))
+
+    # Attributes of the processor, set through its dict so the processor doesn't reference itself. A processor in a
+    # cycle would only be freed, along with its compositor, by the cyclic collector once its world is recycled.
+    exposed = _renderer.__dict__
+    exposed['compositor'] = None
     return _renderer
 
 
+def map_streaming_processor(level_map: ChunkedMap) -> ProcessorFunc:
+    """Returns a processor that drops the chunks of the given map the players have left behind"""
+
+    @access(reads=(PlayerInput, Transform), writes=(Vision,))
+    def _stream(term: Terminal, world: World, dt: float, inp: str) -> None:
+        rows = [world.get_component(player.entity, Transform).position.y for player in world.view(PlayerInput)]
+        if rows and level_map.follow(min(rows)):
+            # Forget having seen the rows that are gone too, or the masks would grow with the distance travelled
+            for vision in world.view(Vision):
+                for y in [y for y in vision.seen if y < level_map.first_row]:
+                    del vision.seen[y]
+
+    return _stream
+
+
+def fov_processor(level_map: MapType) -> ProcessorFunc:
+    """Returns a processor that updates what Vision components can see of the given map"""
+
+    @access(reads=(Transform,), writes=(Vision,))
+    def _fov(term: Terminal, world: World, dt: float, inp: str) -> None:
+        for vision in world.view(Vision):
+            x, y = world.get_component(vision.entity, Transform).position
+            if (x, y) == vision.origin:
+                continue
+            # A new mask rather than an updated one, so whoever holds the old one can tell what changed
+            vision.visible = compute_fov(level_map, x, y, vision.radius)
+            for row, mask in vision.visible.items():
+                vision.seen[row] = vision.seen.get(row, 0) | mask
+            vision.origin = (x, y)
+
+    return _fov
+
+
+@access(reads=(PlayerInput,), writes=(Movement, Renderable))
 def input_processor(term: Terminal, world: World, dt: float, inp: str) -> None:
     """Processor that handles inputs for PlayerInput components"""
-    player_inputs = world.get_components(PlayerInput)
+    player_inputs = world.view(PlayerInput)
     for component in player_inputs:
         movement = world.get_component(component.entity, Movement)
         renderable = world.get_component(component.entity, Renderable)
@@ -92,27 +179,118 @@ def input_processor(term: Terminal, world: World, dt: float, inp: str) -> None:
                 movement.direction = Vector2.ZERO
 
 
-def enemy_movement(current_map: MapType) -> ProcessorFunc:
-    """Returns a processor that calculates movement paths for enemies on the given map"""
-
+@dataclasses.dataclass
+class AILevelOfDetail(object):
+    """How often FollowAI enemies are updated depending on their distance to the transform they follow"""
+
+    near_radius: int = 10  # Enemies this close are updated every cadence ticks
+    far_radius: int = 30  # Enemies further away than this share the far budget
+    cadence: int = 4  # Ticks between updates of near enemies
+    max_interval: int = 32  # Longest any enemy goes without an update
+    far_budget: int = 16  # Most far enemies updated in a single tick, the rest wait their turn
+
+
+def enemy_movement(current_map: MapType, lod: Optional[AILevelOfDetail] = None) -> ProcessorFunc:
+    """
+    Returns a processor that calculates movement paths for enemies on the given map
+
+    Enemies are kept in queues ordered by the tick of their next update. An enemy that is further away is
+    rescheduled later, but never later than the player could take to come within the near radius, so each
+    tick only touches the enemies that are due. Far enemies have their own queue, of which at most the far
+    budget is served per tick. Enemies that were added or removed come from the world's watch of FollowAI,
+    so no tick scans every enemy. Bucket counts are kept on the processor's lod_stats.
+    """
+    lod = lod or AILevelOfDetail()
+    now = 0
+    sequence = itertools.count()  # Tie breaker, enemies due on the same tick are served in turn
+    schedule: List[Tuple[int, int, EntityId]] = []
+    far_schedule: List[Tuple[int, int, EntityId]] = []
+    bucket_of: Dict[EntityId, str] = {}
+    # Sequence number of every enemy's live queue entry, entries of enemies that are gone are skipped when due
+    scheduled: Dict[EntityId, int] = {}
+    moved: List[Movement] = []
+    watched: Optional[World] = None
+    changes: Optional[ComponentChanges] = None  # Enemies added to and removed from the watched world
+    # Bucket sizes, and the enemies updated last tick. Far updates at the budget mean far enemies are waiting.
+    stats = {'near': 0, 'mid': 0, 'far': 0, 'updated': 0, 'far_updated': 0}
+
+    def _watch(world: World) -> ComponentChanges:
+        schedule.clear()
+        far_schedule.clear()
+        bucket_of.clear()
+        scheduled.clear()
+        moved.clear()
+        stats.update(near=0, mid=0, far=0)
+        return world.watch(FollowAI)
+
+    def _bucket(entity_id: EntityId, bucket: Optional[str]) -> None:
+        previous = bucket_of.pop(entity_id, None)
+        if previous is not None:
+            stats[previous] -= 1
+        if bucket is not None:
+            bucket_of[entity_id] = bucket
+            stats[bucket] += 1
+
+    def _schedule(queue: List[Tuple[int, int, EntityId]], tick: int, entity_id: EntityId) -> None:
+        scheduled[entity_id] = next(sequence)
+        heapq.heappush(queue, (tick, scheduled[entity_id], entity_id))
+
+    def _due(queue: List[Tuple[int, int, EntityId]], limit: Optional[int] = None) -> Iterator[EntityId]:
+        served = 0
+        while queue and queue[0][0] <= now and (limit is None or served < limit):
+            _, entry, entity_id = heapq.heappop(queue)
+            if scheduled.get(entity_id) == entry:
+                served += 1
+                yield entity_id
+
+    @access(reads=(Transform,), writes=(FollowAI, Movement, Renderable))
     def enemy_movement_processor(term: Terminal, world: World, dt: float, inp: str) -> None:
-        AIs = world.get_components(FollowAI)
-        for component in AIs:
-            movement = world.get_component(component.entity, Movement)
-            if component.ticks_since_move < 3:
-                component.ticks_since_move += 1
-                movement.direction = Vector2.ZERO
+        nonlocal now, changes, watched
+        now += 1
+        stats['updated'] = stats['far_updated'] = 0
+        if changes is None or changes.closed or world is not watched:
+            changes, watched = _watch(world), world
+
+        # Enemies only move on the tick they were updated
+        for movement in moved:
+            movement.direction = Vector2.ZERO
+        moved.clear()
+
+        added, removed = changes.take()
+        for entity_id in removed:
+            scheduled.pop(entity_id, None)
+            _bucket(entity_id, None)
+        # Sorted, so enemies added on the same tick are served in the order they were created
+        for entity_id in sorted(added):
+            if entity_id not in scheduled:
+                world.get_component(entity_id, Movement).direction = Vector2.ZERO
+                _schedule(schedule, now + lod.cadence - 1, entity_id)
+                _bucket(entity_id, 'near')
+
+        for entity_id in itertools.chain(_due(schedule), _due(far_schedule, lod.far_budget)):
+            component = world.get_component(entity_id, FollowAI)
+            if component.follow_transform is None:
+                _schedule(schedule, now + lod.max_interval, entity_id)
                 continue
-            else:
-                component.ticks_since_move = 0
 
-            renderable = world.get_component(component.entity, Renderable)
-            player_location = component.follow_transform
-            transform = world.get_component(component.entity, Transform)
-            follow_path = transform.position - player_location.position
-            # follow_path *=.5
-            '''f follow_path.mag()>=2:
-                transform.position=transform.position+follow_path'''
+            transform = world.get_component(entity_id, Transform)
+            follow_path = transform.position - component.follow_transform.position
+            distance = max(abs(follow_path.x), abs(follow_path.y))
+            if distance <= lod.near_radius:
+                _bucket(entity_id, 'near')
+                interval = lod.cadence
+            else:
+                _bucket(entity_id, 'far' if distance > lod.far_radius else 'mid')
+                # The player closes in by at most a cell per tick, wake up before they could be near
+                interval = min(max(lod.cadence, distance - lod.near_radius), lod.max_interval)
+            queue = far_schedule if bucket_of[entity_id] == 'far' else schedule
+            _schedule(queue, now + interval, entity_id)
+            stats['updated'] += 1
+            stats['far_updated'] += queue is far_schedule
+
+            movement = world.get_component(entity_id, Movement)
+            renderable = world.get_component(entity_id, Renderable)
+            moved.append(movement)
 
             # TODO: Shouldn't apply scalars here, instead should correctly apply them in the movement processor
             if (follow_path).y > 0:
@@ -128,66 +306,30 @@ def enemy_movement(current_map: MapType) -> ProcessorFunc:
                 movement.direction += Vector2.RIGHT
                 renderable.character = u'O'
 
+    enemy_movement_processor.lod_stats = stats
     return enemy_movement_processor
 
 
+@access(reads=(Text,), writes=(Terminal,))
 def text_renderer(term: Terminal, world: World, dt: float, inp: str) -> None:
     """Renders text components"""
-    # color_bg = term.on_blue
-    # # Blank the screen
-    # echo(term.move_yx(1, 1))
-    # echo(color_bg(term.clear))
-
-    text_components = world.get_components(Text)
-    for idx, text in enumerate(text_components):
-        text_color = f'{text.fg_color}_{text.bg_color}'
-        text_func = term.__getattr__(text_color)
-
-        if text.h_align == Text.HorizontalAlign.LEFT:
-            h_align = term.ljust
-        elif text.h_align == Text.HorizontalAlign.CENTER:
-            h_align = term.center
-        elif text.h_align == Text.HorizontalAlign.RIGHT:
-            h_align = term.rjust
-        else:
-            h_align = term.ljust
-
-        if text.v_align == Text.VerticalAlign.TOP:
-            y_offset = 0
-        elif text.v_align == Text.VerticalAlign.CENTER:
-            y_offset = term.height // 2
-        elif text.v_align == Text.VerticalAlign.BOTTOM:
-            y_offset = term.height - 1
-        else:
-            y_offset = 0
-
-        with term.location(0, y_offset):
-            echo(h_align(text_func(text.text_string)))
+    for text in world.view(Text):
+        # Everything goes through echo, so whatever captures the output sees the cursor moves too
+        echo(layout_cache.text(term, text).rendered)
 
 
+@access(reads=(Ascii,), writes=(Terminal,))
 def ascii_renderer(term: Terminal, world: World, dt: float, inp: str) -> None:
-    """Renders text components"""
-    # color_bg = term.on_blue
-    # # Blank the screen
-    # echo(term.move_yx(1, 1))
-    # echo(color_bg(term.clear))
-
-    ascii_components = world.get_components(Ascii)
-    center_height = term.height // 2
-    for ascii in ascii_components:
-        half_art_len = len(ascii.art) // 2
-        base_offset = center_height - half_art_len
-        for idx, line in enumerate(ascii.art):
-            with term.location(0, base_offset + idx):
-                text_color = f'{ascii.fg_color}_{ascii.bg_color}'
-                text_func = term.__getattr__(text_color)
-                echo(term.center(text_func(line)))
+    """Renders ascii art components"""
+    for art in world.view(Ascii):
+        echo(layout_cache.ascii(term, art).rendered)
 
 
+@access(writes=(TimeToLive,))
 def ttl_processor(term: Terminal, world: World, dt: float, inp: str) -> None:
     """Process lifetimes for TimeToLive components"""
-    ttl_components = world.get_components(TimeToLive)
+    ttl_components = world.view(TimeToLive)
     for ttl in ttl_components:
         if ttl.start_time is None:
-            ttl.start_time = time.monotonic()
-        ttl.current_time = time.monotonic()
+            ttl.start_time = world.time
+        ttl.current_time = world.time
@@ -0,0 +1,215 @@
+import argparse
+import codecs
+import dataclasses
+import fcntl
+import json
+import os
+import pty
+import select
+import statistics
+import struct
+import subprocess  # noqa: S404
+import sys
+import termios
+import time
+from typing import Dict, List, Optional, Tuple
+
+from game.utils import FRAME_MARKER_PREFIX, FRAME_MARKER_SUFFIX
+from game.vt import VirtualTerminal
+
+# Characters the player sprite is drawn with, a key counts as visible once one of them changes on screen
+PLAYER_GLYPHS = frozenset(u'^v<>')
+# Screens that react to keys, keystrokes are only sent while one of them is on screen
+INTERACTIVE_SCREENS = frozenset({'GameLevel'})
+
+
+@dataclasses.dataclass
+class Frame(object):
+    """A frame as it arrived on the terminal"""
+
+    screen: str
+    received: float  # Seconds since the game was started
+    size: int  # Bytes, without the frame marker
+    changed: int  # Cells that differ from the previous frame
+
+
+@dataclasses.dataclass
+class ScreenStats(object):
+    """Rendering statistics of one screen type"""
+
+    screen: str
+    frames: int
+    fps: float
+    time_to_first_frame: float  # Seconds from the last frame of the previous screen, or from the start of the game
+    bytes_per_frame_mean: float
+    bytes_per_frame_max: int
+    cells_changed_mean: float
+    keys_sent: int = 0
+    keys_visible: int = 0
+    input_latency_mean: Optional[float] = None
+    input_latency_max: Optional[float] = None
+
+
+def _screen_stats(frames: List[Frame], latencies: Dict[str, List[float]],
+                  keys_sent: Dict[str, int]) -> List[ScreenStats]:
+    stats = []
+    previous_received = 0.0
+    by_screen: Dict[str, List[Frame]] = {}
+    first_frame: Dict[str, float] = {}
+    for frame in frames:
+        if frame.screen not in by_screen:
+            by_screen[frame.screen] = []
+            first_frame[frame.screen] = frame.received - previous_received
+        by_screen[frame.screen].append(frame)
+        previous_received = frame.received
+
+    for screen, screen_frames in by_screen.items():
+        sizes = [frame.size for frame in screen_frames]
+        # Screens are shown more than once, count only the time between consecutive frames of the same screen
+        active = sum(
+            current.received - previous.received for previous, current in zip(frames, frames[1:])
+            if previous.screen == screen and current.screen == screen
+        )
+        screen_latencies = latencies.get(screen, [])
+        stats.append(ScreenStats(
+            screen=screen,
+            frames=len(screen_frames),
+            fps=(len(screen_frames) - 1) / active if active > 0 else 0.0,
+            time_to_first_frame=first_frame[screen],
+            bytes_per_frame_mean=statistics.mean(sizes),
+            bytes_per_frame_max=max(sizes),
+            cells_changed_mean=statistics.mean(frame.changed for frame in screen_frames),
+            keys_sent=keys_sent.get(screen, 0),
+            keys_visible=len(screen_latencies),
+            input_latency_mean=statistics.mean(screen_latencies) if screen_latencies else None,
+            input_latency_max=max(screen_latencies) if screen_latencies else None,
+        ))
+    return stats
+
+
+def _spawn(argv: List[str], width: int, height: int) -> Tuple[subprocess.Popen, int]:
+    controller, follower = pty.openpty()
+    fcntl.ioctl(follower, termios.TIOCSWINSZ, struct.pack('HHHH', height, width, 0, 0))
+    # Runs the game on the interpreter running the harness
+    process = subprocess.Popen(  # noqa: S603
+        [sys.executable, '-m', 'game.main', '--frame-marker'] + argv,
+        stdin=follower, stdout=follower, stderr=follower,
+        env=dict(os.environ, TERM='xterm-256color'),
+        start_new_session=True
+    )
+    os.close(follower)
+    return process, controller
+
+
+def run_harness(duration: float = 30.0, seed: int = 0, width: int = 80, height: int = 24, keys: str = u'sdsa',
+                key_interval: float = 0.25, key_timeout: float = 1.0, game_args: Optional[List[str]] = None) -> dict:
+    """
+    Play the game on a pseudo-terminal and measure what arrives on the other end.
+
+    Keys from the script are sent in turn while an interactive screen is shown, the next one once the previous
+    one became visible or timed out.
+
+    :param duration: Seconds to run the game for
+    :param seed: Seed passed to the game
+    :param width: Columns of the pseudo-terminal
+    :param height: Rows of the pseudo-terminal
+    :param keys: Keystrokes to cycle through, consecutive keys should turn the player to differ on screen
+    :param key_interval: Minimum seconds between keystrokes
+    :param key_timeout: Seconds after which a keystroke that changed nothing is given up on
+    :param game_args: Additional arguments for the game
+    :return: Dictionary of results
+    """
+    vt = VirtualTerminal(width, height)
+    decoder = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    prefix, suffix = FRAME_MARKER_PREFIX.encode('utf-8'), FRAME_MARKER_SUFFIX.encode('utf-8')
+    frames: List[Frame] = []
+    latencies: Dict[str, List[float]] = {}
+    keys_sent: Dict[str, int] = {}
+    pending_key: Optional[Tuple[float, str]] = None
+    last_key, key_index = 0.0, 0
+    total_bytes = 0
+    buffer = b''
+
+    start = time.perf_counter()
+    process, controller = _spawn(['--seed', str(seed)] + list(game_args or ()), width, height)
+    try:
+        while time.perf_counter() - start < duration and process.poll() is None:
+            readable, _, _ = select.select([controller], [], [], 0.01)
+            now = time.perf_counter() - start
+            if readable:
+                try:
+                    data = os.read(controller, 1 << 16)
+                except OSError:
+                    break
+                total_bytes += len(data)
+                buffer += data
+
+            while True:
+                marker = buffer.find(prefix)
+                end = buffer.find(suffix, marker) if marker >= 0 else -1
+                if end < 0:
+                    break
+                vt.feed(decoder.decode(buffer[:marker]))
+                dirty = vt.take_dirty()
+                screen = buffer[marker + len(prefix):end].decode('utf-8', 'replace')
+                frames.append(Frame(screen=screen, received=now, size=marker, changed=len(dirty)))
+                buffer = buffer[end + len(suffix):]
+
+                if pending_key is not None and any(vt.cells[y][x][0] in PLAYER_GLYPHS for x, y in dirty):
+                    sent, key_screen = pending_key
+                    latencies.setdefault(key_screen, []).append(now - sent)
+                    pending_key = None
+
+            if pending_key is not None and now - pending_key[0] > key_timeout:
+                pending_key = None
+            if (pending_key is None and frames and frames[-1].screen in INTERACTIVE_SCREENS
+                    and now - last_key >= key_interval):
+                os.write(controller, keys[key_index % len(keys)].encode('utf-8'))
+                key_index += 1
+                last_key = now
+                pending_key = (now, frames[-1].screen)
+                keys_sent[frames[-1].screen] = keys_sent.get(frames[-1].screen, 0) + 1
+    finally:
+        if process.poll() is None:
+            os.write(controller, b'q')
+            try:
+                process.wait(5)
+            except subprocess.TimeoutExpired:
+                process.kill()
+                process.wait()
+        os.close(controller)
+
+    return {
+        'duration': duration,
+        'seed': seed,
+        'size': [width, height],
+        'bytes': total_bytes,
+        'frames': len(frames),
+        'time_to_first_frame': frames[0].received if frames else None,
+        'screens': [dataclasses.asdict(stats) for stats in _screen_stats(frames, latencies, keys_sent)],
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Entrypoint for the pseudo-terminal render harness"""
+    parser = argparse.ArgumentParser(description='Measure Dedicated Dugongs rendering on a pseudo-terminal')
+    parser.add_argument('--duration', type=float, default=30.0, help='Seconds to play for')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--width', type=int, default=80)
+    parser.add_argument('--height', type=int, default=24)
+    parser.add_argument('--keys', default=u'sdsa', help='Keystrokes to cycle through on interactive screens')
+    parser.add_argument('--key-interval', type=float, default=0.25, help='Minimum seconds between keystrokes')
+    parser.add_argument('--output', metavar='PATH', default=None, help='Write the results to a file')
+    args, game_args = parser.parse_known_args(argv)
+
+    results = run_harness(args.duration, args.seed, args.width, args.height, args.keys, args.key_interval,
+                          game_args=game_args)
+    if args.output is None:
+        print(json.dumps(results, indent=2))
+    else:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,198 @@
+import dataclasses
+import gzip
+import hashlib
+import json
+import os
+import random
+import time
+from typing import IO, List, Optional, Tuple
+
+from blessed import Terminal
+
+from game.ecs.world import World
+from game.utils import output_to
+
+# Bumped whenever world_digest hashes the same state differently, older recordings can't be verified anymore
+RECORDING_VERSION = 2
+
+# A recorded tick is (dt, input, world digest). The digest is None on ticks that were not hashed.
+TickRecord = Tuple[float, Optional[str], Optional[str]]
+
+
+class ReplayDivergence(Exception):
+    """Raised when a replayed session stops matching the recorded state hashes"""
+
+    def __init__(self, tick: int, expected: str, actual: str):
+        super(ReplayDivergence, self).__init__(
+            f'Replay diverged at tick {tick}: expected state {expected}, got {actual}'
+        )
+        self.tick = tick
+        self.expected = expected
+        self.actual = actual
+
+
+@dataclasses.dataclass
+class SessionHeader(object):
+    """Metadata written at the start of every recording"""
+
+    seed: int
+    width: int = 80
+    height: int = 24
+    hash_interval: int = 1
+    version: int = RECORDING_VERSION
+    endless: bool = False  # Whether the levels were endless ones, see state.endless_progression
+    level_rows: Optional[int] = None
+
+
+@dataclasses.dataclass
+class ReplayResult(object):
+    """Summary of a finished replay"""
+
+    ticks: int
+    verified: int
+    elapsed: float
+
+    @property
+    def ticks_per_second(self) -> float:
+        """Return the replay throughput"""
+        return self.ticks / self.elapsed if self.elapsed > 0 else float('inf')
+
+
+def world_digest(world: World) -> str:
+    """
+    Hash the state of every component in a world.
+
+    :param world: World to hash
+    :return: Hex digest of the world state
+    """
+    digest = hashlib.blake2b(digest_size=8)
+    digest.update(repr(world.time).encode())
+    for c_type in sorted(world.components, key=lambda t: t.__qualname__):
+        components = world.components[c_type]
+        if not components:
+            # Recycled worlds keep empty storage for types they held before
+            continue
+        digest.update(c_type.__qualname__.encode())
+        for entity_id in sorted(components):
+            digest.update(repr(components[entity_id]).encode())
+    return digest.hexdigest()
+
+
+class SessionRecorder(object):
+    """Writes the per-tick input stream of a session to a gzip compressed file"""
+
+    def __init__(self, path: str, header: SessionHeader):
+        self.header = header
+        self.ticks = 0
+        self._file: IO[str] = gzip.open(path, 'wt', encoding='utf-8')
+        self._file.write(json.dumps(dataclasses.asdict(header)) + '\n')
+
+    def __enter__(self) -> 'SessionRecorder':
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.close()
+
+    def record(self, dt: float, inp: Optional[str], world: World) -> None:
+        """
+        Record a single tick.
+
+        :param dt: Delta passed to the tick
+        :param inp: Keyboard input passed to the tick
+        :param world: World of the screen that was ticked, after the tick ran
+        :return: None
+        """
+        digest = world_digest(world) if self.ticks % self.header.hash_interval == 0 else None
+        self._file.write(json.dumps([dt, None if inp is None else str(inp), digest], separators=(',', ':')) + '\n')
+        self.ticks += 1
+
+    def close(self) -> None:
+        """
+        Flush and close the recording.
+
+        :return: None
+        """
+        self._file.close()
+
+
+def load_session(path: str) -> Tuple[SessionHeader, List[TickRecord]]:
+    """
+    Load a recording from disk.
+
+    :param path: Path of the recording
+    :return: A tuple containing the header and the recorded ticks
+    """
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        header = SessionHeader(**json.loads(f.readline()))
+        if header.version != RECORDING_VERSION:
+            raise ValueError(f'Unsupported recording version {header.version}')
+        ticks = [tuple(json.loads(line)) for line in f]
+    return header, ticks
+
+
+class FixedSizeTerminal(Terminal):
+    """Terminal that reports a set size, whatever the size of the process' own terminal"""
+
+    def __init__(self, width: int, height: int, stream: IO[str]):
+        super(FixedSizeTerminal, self).__init__(kind='xterm-256color', stream=stream, force_styling=True)
+        self._fixed_width = width
+        self._fixed_height = height
+
+    @property
+    def width(self) -> int:
+        """Width the terminal was made with"""
+        return self._fixed_width
+
+    @property
+    def height(self) -> int:
+        """Height the terminal was made with"""
+        return self._fixed_height
+
+
+def headless_terminal(width: int = 80, height: int = 24) -> Terminal:
+    """
+    Create a terminal that renders escape sequences into nothing.
+
+    :param width: Width the terminal reports
+    :param height: Height the terminal reports
+    :return: Terminal writing to the null device
+    """
+    return FixedSizeTerminal(width, height, open(os.devnull, 'w'))
+
+
+def replay_session(path: str, verify: bool = True) -> ReplayResult:
+    """
+    Replay a recording at full speed without a TTY.
+
+    :param path: Path of the recording
+    :param verify: Compare the world state against the recorded hashes
+    :return: Summary of the replay
+    """
+    # Imported here, the state module pulls in every screen and its assets
+    from game.state import Intro, endless_progression
+
+    header, ticks = load_session(path)
+    random.seed(header.seed)
+    # Laid out and rendered for the terminal the session was played on
+    term = headless_terminal(header.width, header.height)
+    verified = 0
+
+    start = time.perf_counter()
+    with output_to(term.stream):
+        level = Intro(endless_progression(header.level_rows) if header.endless else None)
+        level.setup(term)
+        for tick, (dt, inp, expected) in enumerate(ticks):
+            next_level = level.tick(term, dt, inp)
+            if verify and expected is not None:
+                actual = world_digest(level.world)
+                if actual != expected:
+                    raise ReplayDivergence(tick, expected, actual)
+                verified += 1
+            if next_level is not None:
+                level.teardown()
+                level = next_level
+                level.setup(term)
+    elapsed = time.perf_counter() - start
+    term.stream.close()
+
+    return ReplayResult(ticks=len(ticks), verified=verified, elapsed=elapsed)
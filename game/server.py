@@ -0,0 +1,297 @@
+import argparse
+import asyncio
+import dataclasses
+import io
+import logging
+import multiprocessing
+import os
+import time
+from collections import deque
+from typing import Deque, List, Optional
+
+from game.recording import FixedSizeTerminal
+from game.state import Intro, Screen
+from game.utils import frame_marker, output_to
+
+log = logging.getLogger(__name__)
+
+# Telnet negotiation: the server echoes and suppresses go-ahead, putting clients in character mode
+IAC = 255
+SE, SB, WILL, DONT = 240, 250, 251, 254
+TELNET_HANDSHAKE = bytes((IAC, WILL, 1, IAC, WILL, 3))
+
+# What _read_keys expects next: data, the byte after IAC, an option, or the bytes of a subnegotiation
+_DATA, _COMMAND, _OPTION, _SUBNEGOTIATION, _SUBNEGOTIATION_IAC = range(5)
+
+
+@dataclasses.dataclass
+class ServerConfig(object):
+    """Settings for a game server"""
+
+    host: str = '127.0.0.1'
+    port: int = 2323
+    workers: int = 1
+    max_sessions: int = 64  # Per worker
+    tick_interval: float = 1 / 10
+    tick_budget: float = 1 / 50  # CPU time a single session tick may take
+    max_overruns: int = 50  # Consecutive ticks over budget before a session is dropped
+    width: int = 80
+    height: int = 24
+    frame_marker: bool = False
+
+
+class SessionTerminal(FixedSizeTerminal):
+    """Terminal of the client's size whose output is buffered for its connection instead of the process' stdout"""
+
+    def __init__(self, width: int, height: int):
+        super(SessionTerminal, self).__init__(width, height, io.StringIO())
+
+    def take_output(self) -> bytes:
+        """
+        Take everything written since the last call.
+
+        :return: Encoded output, with newlines translated for a raw socket
+        """
+        output = self.stream.getvalue()
+        self.stream.seek(0)
+        self.stream.truncate()
+        return output.replace('\n', '\r\n').encode('utf-8')
+
+
+class Session(object):
+    """A single player's progression through the game"""
+
+    def __init__(self, term: SessionTerminal):
+        self.term = term
+        self.keys: Deque[str] = deque()
+        self.screen: Screen = Intro()
+        self.overruns = 0
+        self.ticks = 0
+        self.finished = False
+        with output_to(term.stream):
+            self.screen.setup(term)
+
+    def step(self, dt: float) -> None:
+        """
+        Tick the session's current screen with the next buffered key.
+
+        :param dt: Delta between ticks
+        :return: None
+        """
+        inp = self.keys.popleft() if self.keys else ''
+        if inp in (u'q', u'Q'):
+            self.finished = True
+            return
+
+        with output_to(self.term.stream):
+            try:
+                next_screen = self.screen.tick(self.term, dt, inp)
+            except StopIteration:
+                # Out of levels
+                self.finished = True
+                return
+            if next_screen is not None:
+                self.screen.teardown()
+                self.screen = next_screen
+                self.screen.setup(self.term)
+        self.ticks += 1
+
+
+class GameServer(object):
+    """Serves independent game sessions multiplexed on one asyncio loop"""
+
+    def __init__(self, config: ServerConfig):
+        self.config = config
+        self.sessions: List[Session] = []
+        self.rejected = 0
+        self.dropped = 0
+        self.lag = 0.0  # Smoothed lateness of session ticks, a measure of how loaded this worker is
+
+    def _admit(self) -> bool:
+        if len(self.sessions) >= self.config.max_sessions:
+            return False
+        # Stop admitting while ticks already run late, new sessions would only slow everyone down
+        return self.lag < self.config.tick_interval / 2
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """
+        Run a session for a client connection.
+
+        :param reader: Client input
+        :param writer: Client output
+        :return: None
+        """
+        if not self._admit():
+            self.rejected += 1
+            writer.write(b'Server full, try again later\r\n')
+            await _close(writer)
+            return
+
+        session = Session(SessionTerminal(self.config.width, self.config.height))
+        self.sessions.append(session)
+        writer.write(TELNET_HANDSHAKE)
+        input_task = asyncio.ensure_future(_read_keys(reader, session.keys))
+        try:
+            await self._run(session, writer)
+        except ConnectionError:
+            pass
+        finally:
+            input_task.cancel()
+            session.screen.teardown()
+            self.sessions.remove(session)
+            await _close(writer)
+
+    async def _run(self, session: Session, writer: asyncio.StreamWriter) -> None:
+        loop = asyncio.get_event_loop()
+        interval = self.config.tick_interval
+        next_tick = last_tick = loop.time()
+
+        while not session.finished:
+            now = loop.time()
+            self.lag += ((now - next_tick) - self.lag) * 0.05
+            dt, last_tick = now - last_tick, now
+
+            # Ticks run on this thread without yielding, so its CPU time leaves out other processes using the core
+            start = time.thread_time()
+            session.step(dt)
+            if time.thread_time() - start > self.config.tick_budget:
+                session.overruns += 1
+                if session.overruns > self.config.max_overruns:
+                    self.dropped += 1
+                    writer.write(b'\r\nSession exceeded its tick budget\r\n')
+                    return
+            else:
+                session.overruns = 0
+
+            output = session.term.take_output()
+            if self.config.frame_marker:
+                output += frame_marker(type(session.screen).__name__).encode('utf-8')
+            writer.write(output)
+            await writer.drain()
+
+            # When running late, skip the missed ticks rather than trying to catch up on them
+            next_tick = max(next_tick + interval, loop.time())
+            await asyncio.sleep(max(0.0, next_tick - loop.time()))
+
+    async def report(self, every: float = 5.0) -> None:
+        """
+        Periodically log the state of the server.
+
+        :param every: Seconds between reports
+        :return: None
+        """
+        while True:
+            await asyncio.sleep(every)
+            log.info(
+                'worker %d: %d sessions, %d rejected, %d dropped, lag %.1fms',
+                os.getpid(), len(self.sessions), self.rejected, self.dropped, self.lag * 1000
+            )
+
+
+async def _read_keys(reader: asyncio.StreamReader, keys: Deque[str]) -> None:
+    """Buffer keys from a client, skipping telnet commands, option negotiation and subnegotiation"""
+    state = _DATA
+    while True:
+        data = await reader.read(1024)
+        if not data:
+            return
+        for byte in data:
+            if state == _DATA:
+                if byte == IAC:
+                    state = _COMMAND
+                elif byte < 128:
+                    keys.append(chr(byte))
+            elif state == _COMMAND:
+                if byte == IAC:
+                    # An escaped data byte
+                    keys.append(chr(IAC))
+                    state = _DATA
+                elif byte == SB:
+                    state = _SUBNEGOTIATION
+                elif WILL <= byte <= DONT:
+                    state = _OPTION
+                else:
+                    state = _DATA
+            elif state == _OPTION:
+                state = _DATA
+            elif state == _SUBNEGOTIATION:
+                if byte == IAC:
+                    state = _SUBNEGOTIATION_IAC
+            else:
+                # IAC SE ends the subnegotiation, IAC IAC is an escaped byte inside it
+                state = _DATA if byte == SE else _SUBNEGOTIATION
+
+
+async def _close(writer: asyncio.StreamWriter) -> None:
+    try:
+        writer.close()
+        await writer.wait_closed()
+    except ConnectionError:
+        pass
+
+
+async def _serve(config: ServerConfig) -> None:
+    server = GameServer(config)
+    # Every worker binds the same port, the kernel spreads incoming connections between them
+    listener = await asyncio.start_server(
+        server.handle, config.host, config.port, reuse_port=config.workers > 1
+    )
+    asyncio.ensure_future(server.report())
+    async with listener:
+        await listener.serve_forever()
+
+
+def _worker(config: ServerConfig) -> None:
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(message)s')
+    try:
+        asyncio.run(_serve(config))
+    except KeyboardInterrupt:
+        pass
+
+
+def serve(config: ServerConfig) -> None:
+    """
+    Run the game server, sharding sessions across worker processes.
+
+    :param config: Server settings
+    :return: None
+    """
+    if config.workers <= 1:
+        _worker(config)
+        return
+
+    workers = [multiprocessing.Process(target=_worker, args=(config,)) for _ in range(config.workers)]
+    for worker in workers:
+        worker.start()
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.terminate()
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Entrypoint for the game server"""
+    defaults = ServerConfig()
+    parser = argparse.ArgumentParser(description='Serve Dedicated Dugongs sessions over TCP/telnet')
+    parser.add_argument('--host', default=defaults.host)
+    parser.add_argument('--port', type=int, default=defaults.port)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='Worker processes')
+    parser.add_argument('--max-sessions', type=int, default=defaults.max_sessions, help='Sessions per worker')
+    parser.add_argument('--tick-budget', type=float, default=defaults.tick_budget, help='CPU seconds per session tick')
+    parser.add_argument('--frame-marker', action='store_true', help='Mark the end of every frame in the stream')
+    args = parser.parse_args(argv)
+
+    serve(ServerConfig(
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        max_sessions=args.max_sessions,
+        tick_budget=args.tick_budget,
+        frame_marker=args.frame_marker
+    ))
+
+
+if __name__ == '__main__':
+    main()
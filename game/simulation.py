@@ -0,0 +1,173 @@
+import argparse
+import dataclasses
+import json
+import multiprocessing
+import os
+import random
+import statistics
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from game.components import PlayerInput, Transform
+from game.mapgeneration import generate_level
+from game.state import LEVEL_PARAMETERS, GameLevel
+
+# An input policy picks the key pressed on the next tick of a level
+InputPolicy = Callable[[GameLevel, random.Random], str]
+
+TICK_INTERVAL = 1 / 10  # Matches the interactive game loop
+
+
+def _player_position(level: GameLevel) -> Tuple[int, int]:
+    player = next(iter(level.world.view(PlayerInput)))
+    transform = level.world.get_component(player.entity, Transform)
+    return transform.position.x, transform.position.y
+
+
+def random_policy(level: GameLevel, rng: random.Random) -> str:
+    """Mash the movement keys"""
+    return rng.choice((u'w', u'a', u's', u'd', u''))
+
+
+def descend_policy(level: GameLevel, rng: random.Random) -> str:
+    """Head down the map, walking along the current row to the nearest opening below"""
+    x, y = _player_position(level)
+    level_map = level.level
+    if y + 1 >= len(level_map) or level_map[y + 1][x] != '#':
+        return u's'
+
+    row, below = level_map[y], level_map[y + 1]
+    for distance in range(1, len(row)):
+        for nx, key in ((x - distance, u'a'), (x + distance, u'd')):
+            if 0 <= nx < len(row) and row[nx] != '#' and below[nx] != '#':
+                return key
+    return rng.choice((u'w', u'a', u'd'))
+
+
+POLICIES: Dict[str, InputPolicy] = {
+    'random': random_policy,
+    'descend': descend_policy,
+}
+
+
+@dataclasses.dataclass
+class SimulationResult(object):
+    """Outcome of a single simulated level"""
+
+    seed: int
+    completed: bool
+    ticks: int
+    sim_time: float  # Seconds that passed on the virtual clock
+    wall_time: float
+    critical_path: int  # Fewest moves the level can be finished in
+    generation_time: float
+    generation_retries: int
+
+
+def simulate_level(seed: int, policy: str = 'descend', max_ticks: int = 5000) -> SimulationResult:
+    """
+    Generate and play through a level without rendering.
+
+    The virtual clock advances in fixed steps of TICK_INTERVAL, like the interactive game loop, since something
+    moves on every tick of a level.
+
+    :param seed: Seed for the map and the input policy
+    :param policy: Name of the input policy
+    :param max_ticks: Ticks after which the level is abandoned
+    :return: Outcome of the level
+    """
+    random.seed(seed)
+    level_map, spawn, report = generate_level(**LEVEL_PARAMETERS)
+    level = GameLevel(level_map, spawn, report)
+    level.render = level.rewind = False
+    rng = random.Random(seed)
+    choose_input = POLICIES[policy]
+
+    start = time.perf_counter()
+    level.setup(None)
+    ticks = 0
+    while not level.completed and ticks < max_ticks:
+        level.tick(None, TICK_INTERVAL, choose_input(level, rng))
+        ticks += 1
+
+    return SimulationResult(
+        seed=seed,
+        completed=level.completed,
+        ticks=ticks,
+        sim_time=level.world.time,
+        wall_time=time.perf_counter() - start,
+        critical_path=report.critical_path,
+        generation_time=report.seconds,
+        generation_retries=report.retries
+    )
+
+
+def _simulate(task: Tuple[int, str, int]) -> SimulationResult:
+    return simulate_level(*task)
+
+
+def run_batch(seeds: List[int], policy: str = 'descend', max_ticks: int = 5000,
+              workers: Optional[int] = None) -> List[SimulationResult]:
+    """
+    Simulate a batch of levels across a pool of worker processes.
+
+    :param seeds: One level is simulated per seed
+    :param policy: Name of the input policy
+    :param max_ticks: Ticks after which a level is abandoned
+    :param workers: Worker processes, defaults to one per core
+    :return: Outcome of every level
+    """
+    tasks = [(seed, policy, max_ticks) for seed in seeds]
+    with multiprocessing.Pool(workers) as pool:
+        return list(pool.imap_unordered(_simulate, tasks, chunksize=max(1, len(tasks) // (4 * (workers or 1)))))
+
+
+def summarize(results: List[SimulationResult], elapsed: float, workers: int) -> dict:
+    """
+    Aggregate the outcome of a batch.
+
+    :param results: Outcome of every level
+    :param elapsed: Wall time the whole batch took
+    :param workers: Worker processes the batch ran on
+    :return: Dictionary of aggregate statistics
+    """
+    ticks = [r.ticks for r in results]
+    completed = [r for r in results if r.completed]
+    total_ticks = sum(ticks)
+    # Time spent inside the simulations, so pool overhead does not count against the simulation
+    sim_wall_time = sum(r.wall_time for r in results)
+    return {
+        'runs': len(results),
+        'workers': workers,
+        'completed': len(completed),
+        'completion_rate': len(completed) / len(results) if results else 0.0,
+        'ticks_mean': statistics.mean(ticks) if results else 0.0,
+        'ticks_median': statistics.median(ticks) if results else 0.0,
+        'ticks_to_complete_median': statistics.median(r.ticks for r in completed) if completed else None,
+        'critical_path_mean': statistics.mean(r.critical_path for r in results) if results else 0.0,
+        'generation_time_mean': statistics.mean(r.generation_time for r in results) if results else 0.0,
+        'generation_retries': sum(r.generation_retries for r in results),
+        'sim_seconds': sum(r.sim_time for r in results),
+        'elapsed': elapsed,
+        'ticks_per_second': total_ticks / elapsed if elapsed > 0 else 0.0,
+        'ticks_per_second_per_core': total_ticks / sim_wall_time if sim_wall_time > 0 else 0.0,
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Entrypoint for headless batch simulations"""
+    parser = argparse.ArgumentParser(description='Simulate Dedicated Dugongs levels headlessly')
+    parser.add_argument('--runs', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0, help='Seed of the first run, each run uses the next')
+    parser.add_argument('--policy', choices=sorted(POLICIES), default='descend')
+    parser.add_argument('--max-ticks', type=int, default=5000)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    args = parser.parse_args(argv)
+
+    start = time.perf_counter()
+    results = run_batch(list(range(args.seed, args.seed + args.runs)), args.policy, args.max_ticks, args.workers)
+    print(json.dumps(summarize(results, time.perf_counter() - start, args.workers), indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,403 @@
+import argparse
+import asyncio
+import dataclasses
+import json
+import multiprocessing
+import random
+import socket
+import statistics
+import threading
+import time
+from typing import Iterable, List, Optional, TextIO
+
+from game.server import Session, SessionTerminal
+from game.simulation import descend_policy
+from game.state import GameLevel
+from game.vt import Position, VirtualTerminal
+
+# Sent to every viewer before their first frame: hide the cursor and reset attributes
+_VIEWER_PREAMBLE = b'\x1b[?25l\x1b[0m'
+
+
+def _sgr(attrs: str) -> str:
+    return f'\x1b[0;{attrs}m' if attrs else '\x1b[0m'
+
+
+def encode_cells(vt: VirtualTerminal, positions: Iterable[Position]) -> bytes:
+    """
+    Encode the current content of some cells as terminal output.
+
+    Cursor moves are only emitted where a run of cells on a row is interrupted and attributes only where they
+    change, so a delta costs roughly a byte per changed character.
+
+    :param vt: Screen to read the cells from
+    :param positions: Cells to encode
+    :return: Output that draws the cells on any xterm compatible terminal
+    """
+    out: List[str] = []
+    cursor, attrs = None, None
+    for x, y in sorted(positions, key=lambda position: (position[1], position[0])):
+        character, cell_attrs = vt.cells[y][x]
+        if cursor != (x, y):
+            out.append(f'\x1b[{y + 1};{x + 1}H')
+        if cell_attrs != attrs:
+            out.append(_sgr(cell_attrs))
+            attrs = cell_attrs
+        out.append(character)
+        cursor = (x + 1, y)
+    return ''.join(out).encode('utf-8')
+
+
+def encode_keyframe(vt: VirtualTerminal) -> bytes:
+    """
+    Encode the whole screen, for viewers that have nothing to apply deltas to.
+
+    :param vt: Screen to encode
+    :return: Output that redraws the screen from scratch
+    """
+    return b'\x1b[0m\x1b[2J' + encode_cells(vt, ((x, y) for y in range(vt.height) for x in range(vt.width)))
+
+
+class FrameCapture(object):
+    """Stream that passes output through to another stream and keeps a copy until it is taken"""
+
+    def __init__(self, stream: TextIO):
+        self.stream = stream
+        self._parts: List[str] = []
+
+    def write(self, data: str) -> int:
+        """Write to the wrapped stream and keep a copy"""
+        self._parts.append(data)
+        return self.stream.write(data)
+
+    def flush(self) -> None:
+        """Flush the wrapped stream"""
+        self.stream.flush()
+
+    def take(self) -> str:
+        """
+        Take everything written since the last call.
+
+        :return: Captured output
+        """
+        output = ''.join(self._parts)
+        self._parts.clear()
+        return output
+
+
+@dataclasses.dataclass
+class BroadcastStats(object):
+    """Counters of a spectator broadcaster"""
+
+    published: int = 0  # Frames the game produced
+    frames: int = 0  # Frames sent out, frames that changed nothing are not
+    keyframes: int = 0
+    viewers: int = 0
+    viewers_peak: int = 0
+    frames_dropped: int = 0  # Frames not sent to a viewer because it was too far behind
+    resyncs: int = 0  # Keyframes sent to viewers catching up after dropped frames
+    encode_time: float = 0.0  # Game thread time spent turning output into deltas
+    fanout_time: float = 0.0  # Broadcast thread time spent handing frames to viewers
+    bytes_sent: int = 0
+
+
+class _Viewer(object):
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        # False after frames were dropped, the viewer waits for a keyframe before it gets deltas again
+        self.synced = False
+
+
+class SpectatorBroadcaster(object):
+    """
+    Streams the frames of a single game to any number of spectators.
+
+    The game's output is applied once to a screen model, and the cells that changed are encoded once as a delta.
+    The same delta is then queued to every viewer by an asyncio loop on a background thread, so the cost of a
+    viewer is one socket write per frame. A keyframe redrawing the whole screen is made every keyframe_interval
+    frames: new viewers get the last keyframe and the deltas since, and viewers whose socket buffer grows past
+    max_buffer stop getting frames until it has drained, then resync the same way.
+    """
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 2324, width: int = 80, height: int = 24,
+                 keyframe_interval: int = 50, max_buffer: int = 1 << 16):
+        self.host = host
+        self.port = port
+        self.keyframe_interval = keyframe_interval
+        self.max_buffer = max_buffer
+        self.stats = BroadcastStats()
+        self._vt = VirtualTerminal(width, height)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._thread: Optional[threading.Thread] = None
+        self._started = threading.Event()
+        # Only touched on the broadcast thread
+        self._viewers: List[_Viewer] = []
+        self._keyframe: Optional[bytes] = None
+        self._since_keyframe: List[bytes] = []
+        self._resync: Optional[bytes] = None
+
+    def __enter__(self) -> 'SpectatorBroadcaster':
+        self.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        """
+        Start accepting viewers on a background thread.
+
+        :return: None
+        """
+        self._thread = threading.Thread(target=self._run, name='spectators', daemon=True)
+        self._thread.start()
+        self._started.wait()
+
+    def stop(self) -> None:
+        """
+        Disconnect every viewer and stop the background thread.
+
+        :return: None
+        """
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+    def publish(self, output: str) -> None:
+        """
+        Broadcast the output of a frame.
+
+        :param output: Everything the game wrote during the frame
+        :return: None
+        """
+        start = time.perf_counter()
+        self._vt.feed(output)
+        dirty = self._vt.take_dirty()
+        keyframe = self.stats.published % self.keyframe_interval == 0
+        frame = encode_keyframe(self._vt) if keyframe else encode_cells(self._vt, dirty)
+        self.stats.published += 1
+        self.stats.encode_time += time.perf_counter() - start
+        if (dirty or keyframe) and self._loop is not None:
+            self._loop.call_soon_threadsafe(self._fan_out, frame, keyframe)
+
+    def _run(self) -> None:
+        self._loop = asyncio.new_event_loop()
+        self._server = self._loop.run_until_complete(
+            asyncio.start_server(self._handle, self.host, self.port, backlog=1024)
+        )
+        self._started.set()
+        try:
+            self._loop.run_forever()
+        finally:
+            self._server.close()
+            for viewer in self._viewers:
+                viewer.writer.close()
+            self._loop.run_until_complete(self._server.wait_closed())
+            self._loop.close()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        viewer = _Viewer(writer)
+        # Without a cap the kernel queues megabytes of stale frames before a slow viewer shows up as behind
+        writer.get_extra_info('socket').setsockopt(socket.SOL_SOCKET, socket.SO_SNDBUF, self.max_buffer)
+        writer.write(_VIEWER_PREAMBLE)
+        self._sync(viewer)
+        self._viewers.append(viewer)
+        self.stats.viewers = len(self._viewers)
+        self.stats.viewers_peak = max(self.stats.viewers_peak, self.stats.viewers)
+        try:
+            # Viewers only watch, anything they send is discarded until they disconnect
+            while await reader.read(1024):
+                pass
+        except ConnectionError:
+            pass
+        finally:
+            self._viewers.remove(viewer)
+            self.stats.viewers = len(self._viewers)
+            writer.close()
+
+    def _sync(self, viewer: _Viewer) -> None:
+        if self._keyframe is None:
+            return
+        if self._resync is None:
+            self._resync = b''.join([self._keyframe] + self._since_keyframe)
+        viewer.writer.write(self._resync)
+        self.stats.bytes_sent += len(self._resync)
+        viewer.synced = True
+
+    def _fan_out(self, frame: bytes, keyframe: bool) -> None:
+        start = time.thread_time()
+        if keyframe:
+            self._keyframe = frame
+            self._since_keyframe = []
+            self.stats.keyframes += 1
+        else:
+            self._since_keyframe.append(frame)
+        self._resync = None
+        self.stats.frames += 1
+
+        for viewer in self._viewers:
+            transport = viewer.writer.transport
+            if transport.is_closing():
+                continue
+            if transport.get_write_buffer_size() > self.max_buffer:
+                viewer.synced = False
+                self.stats.frames_dropped += 1
+            elif viewer.synced:
+                viewer.writer.write(frame)
+                self.stats.bytes_sent += len(frame)
+            else:
+                self.stats.resyncs += 1
+                self._sync(viewer)
+        self.stats.fanout_time += time.thread_time() - start
+
+
+@dataclasses.dataclass
+class ViewerResult(object):
+    """What a load test viewer received"""
+
+    connected: bool = False
+    bytes: int = 0
+    screen: Optional[List[str]] = None  # What the viewer's screen showed at the end
+
+
+async def _watch(host: str, port: int, duration: float, stall: float, width: int,
+                 height: int, keep_screen: bool) -> ViewerResult:
+    result = ViewerResult()
+    vt = VirtualTerminal(width, height) if keep_screen else None
+    sock = socket.socket()
+    sock.setblocking(False)
+    if stall:
+        # Keep the kernel from buffering on behalf of a stalled viewer, so it falls behind quickly
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 4096)
+    try:
+        await asyncio.get_running_loop().sock_connect(sock, (host, port))
+        # The reader stops reading the socket once this much is buffered
+        reader, writer = await asyncio.open_connection(sock=sock, limit=1024 if stall else 1 << 20)
+    except OSError:
+        sock.close()
+        return result
+    result.connected = True
+    deadline = time.monotonic() + duration
+    # Stand-in for a viewer on a connection that stops moving for a while
+    await asyncio.sleep(stall)
+    while True:
+        try:
+            data = await asyncio.wait_for(reader.read(1 << 16), 1.0)
+        except asyncio.TimeoutError:
+            # The broadcast is over once nothing arrived for a while after the deadline
+            if time.monotonic() >= deadline:
+                break
+            continue
+        if not data:
+            break
+        result.bytes += len(data)
+        if vt is not None:
+            vt.feed(data.decode('utf-8', 'replace'))
+    writer.close()
+    if vt is not None:
+        result.screen = vt.display
+    return result
+
+
+def _run_viewers(host: str, port: int, viewers: int, slow: int, duration: float, width: int,
+                 height: int) -> List[ViewerResult]:
+    async def run() -> List[ViewerResult]:
+        # Slow viewers stall for most of the broadcast, then have to resync. They and the last viewer,
+        # which joins last, keep their screens to be compared with the game's.
+        tasks = [
+            _watch(host, port, duration, duration * 2 / 3 if idx < slow else 0.0, width, height,
+                   idx < slow or idx == viewers - 1)
+            for idx in range(viewers)
+        ]
+        return await asyncio.gather(*tasks)
+    return asyncio.run(run())
+
+
+def _viewer_process(queue: multiprocessing.Queue, *args) -> None:
+    queue.put([dataclasses.asdict(result) for result in _run_viewers(*args)])
+
+
+def run_loadtest(viewers: int = 1000, slow: int = 10, duration: float = 30.0, width: int = 80,
+                 height: int = 24, port: int = 2324, seed: int = 0, max_buffer: int = 1 << 12) -> dict:
+    """
+    Broadcast a headless game to many local viewers.
+
+    The viewers run in a separate process so they do not compete with the broadcaster for the GIL. The slow
+    viewers and the last one keep a screen model of what they received, which has to match what the game drew.
+
+    :param viewers: Number of viewers to connect
+    :param slow: How many of the viewers stop reading their socket for most of the test
+    :param duration: Seconds to broadcast for
+    :param width: Columns of the game
+    :param height: Rows of the game
+    :param port: Port to broadcast on
+    :param seed: Seed for the game
+    :param max_buffer: Bytes queued for a viewer before frames are dropped, small so slow viewers fall behind
+    :return: Dictionary of results
+    """
+    random.seed(seed)
+    rng = random.Random(seed)
+    tick_interval = 1 / 10
+    session = Session(SessionTerminal(width, height))
+    queue: multiprocessing.Queue = multiprocessing.Queue()
+
+    with SpectatorBroadcaster(port=port, width=width, height=height, max_buffer=max_buffer) as broadcaster:
+        process = multiprocessing.Process(
+            target=_viewer_process, args=(queue, '127.0.0.1', port, viewers, slow, duration, width, height)
+        )
+        process.start()
+        start = time.perf_counter()
+        next_tick = start
+        while time.perf_counter() - start < duration:
+            if isinstance(session.screen, GameLevel):
+                # Give the viewers something to watch once the level starts
+                session.keys.append(descend_policy(session.screen, rng))
+            session.step(tick_interval)
+            broadcaster.publish(session.term.take_output().decode('utf-8'))
+            next_tick += tick_interval
+            time.sleep(max(0.0, next_tick - time.perf_counter()))
+        results = [ViewerResult(**result) for result in queue.get()]
+        process.join()
+        expected = broadcaster._vt.display
+    stats = broadcaster.stats
+
+    connected = [result for result in results if result.connected]
+    checked = [result for result in connected if result.screen is not None]
+    received = [result.bytes for result in connected]
+    viewer_frames = max(1, stats.frames * stats.viewers_peak)
+    return {
+        'viewers': viewers,
+        'connected': len(connected),
+        'slow_viewers': slow,
+        'published': stats.published,
+        'frames': stats.frames,
+        'keyframes': stats.keyframes,
+        'frames_dropped': stats.frames_dropped,
+        'resyncs': stats.resyncs,
+        'encode_us_per_frame': stats.encode_time / max(1, stats.published) * 1e6,
+        'fanout_us_per_viewer_frame': stats.fanout_time / viewer_frames * 1e6,
+        'bytes_sent': stats.bytes_sent,
+        'bytes_per_viewer_median': statistics.median(received) if received else 0,
+        'viewers_checked': len(checked),
+        'viewers_in_sync': sum(result.screen == expected for result in checked),
+    }
+
+
+def main(argv: Optional[List[str]] = None) -> None:
+    """Entrypoint for the spectator load test"""
+    parser = argparse.ArgumentParser(description='Load test spectator broadcasting with local viewers')
+    parser.add_argument('--viewers', type=int, default=1000)
+    parser.add_argument('--slow', type=int, default=10, help='Viewers that stall and have to resync')
+    parser.add_argument('--duration', type=float, default=30.0, help='Long enough to reach a level')
+    parser.add_argument('--port', type=int, default=2324)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    results = run_loadtest(args.viewers, args.slow, args.duration, port=args.port, seed=args.seed)
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == '__main__':
+    main()
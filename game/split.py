@@ -0,0 +1,356 @@
+import dataclasses
+import json
+import random
+import struct
+import time
+from collections import deque
+from multiprocessing import Pipe, Process, shared_memory
+from multiprocessing.connection import Connection
+from typing import Deque, Dict, List, Optional, Tuple
+
+from blessed import Terminal
+
+from game.components import Ascii, Renderable, Text, Transform, Vision
+from game.ecs import ProcessorFunc
+from game.ecs.world import World
+from game.fov import RowMask
+from game.mapgeneration import MapType
+from game.processors import ascii_renderer, render_system, text_renderer
+from game.state import Cutscene, GameLevel, Intro, Screen
+from game.utils import Vector2, echo
+
+# Which of the two slots holds the latest complete frame
+_LATEST = struct.Struct('<I')
+# Sequence number, frame number, map ID, map bytes, sprite count and extra bytes of the frame in a slot
+_SLOT_HEADER = struct.Struct('<QQIIII')
+# Position, size and character of a sprite
+_SPRITE = struct.Struct('<hhBBI')
+
+MAX_SPRITES = 4096
+MAX_MAP_BYTES = 1 << 16
+MAX_EXTRA_BYTES = 1 << 16
+
+_SPRITES_OFFSET = _SLOT_HEADER.size
+_MAP_OFFSET = _SPRITES_OFFSET + MAX_SPRITES * _SPRITE.size
+_EXTRA_OFFSET = _MAP_OFFSET + MAX_MAP_BYTES
+_SLOT_SIZE = _EXTRA_OFFSET + MAX_EXTRA_BYTES
+FRAME_BUFFER_SIZE = _LATEST.size + 2 * _SLOT_SIZE
+
+_SCREENS = {screen.__name__: screen for screen in (Intro, Cutscene, GameLevel)}
+
+# A sprite is the Transform position and the Renderable of an entity: x, y, w, h and character
+Sprite = Tuple[int, int, int, int, str]
+
+
+@dataclasses.dataclass
+class Frame(object):
+    """Everything needed to draw a tick of the simulation"""
+
+    number: int
+    screen: str
+    map_id: int
+    level_map: Optional[MapType]
+    sprites: List[Sprite]
+    texts: List[Text]
+    ascii: List[Ascii]
+    vision: List[Vision]
+
+
+def _slot_offset(slot: int) -> int:
+    return _LATEST.size + slot * _SLOT_SIZE
+
+
+class FramePublisher(object):
+    """
+    Writes frames into shared memory for a FrameReader in another process.
+
+    There are two slots: a frame is written to the one not holding the latest frame, which is then made the
+    latest. Each slot has a sequence number that is odd while the slot is written, so a reader can tell a
+    consistent copy from one that raced a write and try again. The map is only copied into a slot when the
+    slot holds a different one. A map or extras too big for their part of a slot raise ValueError before the
+    slot is touched.
+    """
+
+    def __init__(self, buffer: memoryview):
+        self.buffer = buffer
+        self._map_ids = [0, 0]
+        self._frames = 0
+        self._map_id = 0
+        self._map: Optional[MapType] = None
+        self._encoded_map = b''
+
+    def publish(self, screen: Screen) -> None:
+        """
+        Write the state of a screen as the latest frame.
+
+        :param screen: Screen that was just ticked
+        :return: None
+        """
+        world = screen.world
+        level_map = getattr(screen, 'level', None)
+        if level_map is not self._map:
+            encoded_map = b'' if level_map is None else '\n'.join(''.join(row) for row in level_map).encode()
+            if len(encoded_map) > MAX_MAP_BYTES:
+                raise ValueError(f'Map of {len(encoded_map)} bytes does not fit the {MAX_MAP_BYTES} bytes of a slot')
+            self._map, self._map_id, self._encoded_map = level_map, self._map_id + 1, encoded_map
+
+        extra = json.dumps({
+            'screen': type(screen).__name__,
+            'texts': [_fields(text) for text in world.view(Text)],
+            'ascii': [_fields(art) for art in world.view(Ascii)],
+            # Row masks, and the origin the renderer scrolls the view along with
+            'vision': [(vision.visible, vision.seen, vision.origin) for vision in world.view(Vision)],
+        }).encode('utf-8')
+        if len(extra) > MAX_EXTRA_BYTES:
+            raise ValueError(
+                f'Texts, art and vision of {len(extra)} bytes do not fit the {MAX_EXTRA_BYTES} bytes of a slot'
+            )
+
+        slot = 1 - _LATEST.unpack_from(self.buffer, 0)[0]
+        base = _slot_offset(slot)
+        seq = _SLOT_HEADER.unpack_from(self.buffer, base)[0]
+        _SLOT_HEADER.pack_into(self.buffer, base, seq + 1, 0, 0, 0, 0, 0)
+
+        count = 0
+        for renderable in world.view(Renderable):
+            if count == MAX_SPRITES:
+                break
+            x, y = world.get_component(renderable.entity, Transform).position
+            _SPRITE.pack_into(
+                self.buffer, base + _SPRITES_OFFSET + count * _SPRITE.size,
+                x, y, renderable.w, renderable.h, ord(renderable.character)
+            )
+            count += 1
+
+        map_size = len(self._encoded_map)
+        if self._map_ids[slot] != self._map_id:
+            self.buffer[base + _MAP_OFFSET:base + _MAP_OFFSET + map_size] = self._encoded_map
+            self._map_ids[slot] = self._map_id
+
+        self.buffer[base + _EXTRA_OFFSET:base + _EXTRA_OFFSET + len(extra)] = extra
+
+        self._frames += 1
+        _SLOT_HEADER.pack_into(self.buffer, base, seq + 2, self._frames, self._map_id, map_size, count, len(extra))
+        _LATEST.pack_into(self.buffer, 0, slot)
+
+
+def _fields(component: object) -> dict:
+    fields = dataclasses.asdict(component)
+    del fields['entity']
+    return fields
+
+
+class FrameReader(object):
+    """Reads the latest consistent frame written by a FramePublisher"""
+
+    def __init__(self, buffer: memoryview):
+        self.buffer = buffer
+        self.frame = 0
+        self.retries = 0
+        self._map_id = 0
+        self._map: Optional[MapType] = None
+
+    def read(self) -> Optional[Frame]:
+        """
+        Copy the latest frame out of shared memory.
+
+        :return: The frame, None if there is no frame newer than the last one read
+        """
+        while True:
+            slot = _LATEST.unpack_from(self.buffer, 0)[0]
+            base = _slot_offset(slot)
+            seq, number, map_id, map_size, count, extra_size = _SLOT_HEADER.unpack_from(self.buffer, base)
+            if number == self.frame and seq % 2 == 0:
+                return None
+            if seq % 2:
+                self.retries += 1
+                continue
+
+            sprites = [
+                _SPRITE.unpack_from(self.buffer, base + _SPRITES_OFFSET + idx * _SPRITE.size) for idx in range(count)
+            ]
+            extra = bytes(self.buffer[base + _EXTRA_OFFSET:base + _EXTRA_OFFSET + extra_size])
+            level_map = self._map
+            if map_id != self._map_id and map_size:
+                level_map = bytes(self.buffer[base + _MAP_OFFSET:base + _MAP_OFFSET + map_size])
+
+            if _SLOT_HEADER.unpack_from(self.buffer, base)[0] != seq:
+                # The publisher wrapped around to this slot while it was copied
+                self.retries += 1
+                continue
+            break
+
+        if isinstance(level_map, bytes):
+            level_map = [list(row) for row in level_map.decode('utf-8').split('\n')]
+        self.frame, self._map_id, self._map = number, map_id, level_map
+        extra = json.loads(extra)
+        return Frame(
+            number=number,
+            screen=extra['screen'],
+            map_id=map_id,
+            level_map=level_map if map_size else None,
+            sprites=[(x, y, w, h, chr(character)) for x, y, w, h, character in sprites],
+            texts=[Text(**fields) for fields in extra['texts']],
+            ascii=[Ascii(**fields) for fields in extra['ascii']],
+            vision=[
+                Vision(visible=_row_masks(visible), seen=_row_masks(seen), origin=origin and tuple(origin))
+                for visible, seen, origin in extra['vision']
+            ],
+        )
+
+
+def _row_masks(masks: Dict[str, int]) -> RowMask:
+    # JSON turned the row numbers into strings
+    return {int(y): mask for y, mask in masks.items()}
+
+
+@dataclasses.dataclass
+class SimulationStats(object):
+    """How steadily the simulation process ticked"""
+
+    ticks: int = 0
+    elapsed: float = 0.0
+    longest_tick: float = 0.0  # Longest time between two ticks
+
+    @property
+    def ticks_per_second(self) -> float:
+        """Return the simulation tick rate"""
+        return self.ticks / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def simulate(shm_name: str, conn: Connection, seed: Optional[int], tick_interval: float) -> None:
+    """
+    Run the game headlessly, publishing every tick to shared memory.
+
+    Keys arrive over the pipe and are used one per tick. None on the pipe stops the simulation, which then
+    sends its SimulationStats back.
+
+    :param shm_name: Name of the shared memory block to publish to
+    :param conn: Pipe to the render process
+    :param seed: Seed for the random number generator
+    :param tick_interval: Seconds between ticks
+    :return: None
+    """
+    if seed is not None:
+        random.seed(seed)
+    shm = shared_memory.SharedMemory(name=shm_name)
+    publisher = FramePublisher(shm.buf)
+    keys: Deque[str] = deque()
+    stats = SimulationStats()
+
+    level: Screen = Intro()
+    level.render = False
+    level.setup(None)
+    start = last_tick = next_tick = time.monotonic()
+    running = True
+    while running:
+        while conn.poll():
+            key = conn.recv()
+            if key is None:
+                running = False
+            else:
+                keys.append(key)
+
+        now = time.monotonic()
+        dt, last_tick = now - last_tick, now
+        stats.longest_tick = max(stats.longest_tick, dt if stats.ticks else 0.0)
+        try:
+            next_level = level.tick(None, dt, keys.popleft() if keys else '')
+        except StopIteration:
+            # Out of levels
+            break
+        publisher.publish(level)
+        stats.ticks += 1
+        if next_level is not None:
+            level.teardown()
+            level = next_level
+            level.render = False
+            level.setup(None)
+
+        next_tick = max(next_tick + tick_interval, time.monotonic())
+        time.sleep(max(0.0, next_tick - time.monotonic()))
+
+    stats.elapsed = time.monotonic() - start
+    shm.close()
+    conn.send(stats)
+
+
+class FrameRenderer(object):
+    """
+    Draws frames with the game's own render processors.
+
+    Every frame is loaded into a world of its own, whose only processors are the renderers of the frame's
+    screen. The map renderer is kept while the map stays the same, so only the sprites that moved are redrawn.
+    """
+
+    def __init__(self):
+        self.world = World()
+        self._map_id = 0
+        self._map_renderer: Optional[ProcessorFunc] = None
+
+    def draw(self, term: Terminal, frame: Frame) -> None:
+        """
+        Draw a frame.
+
+        :param term: Terminal to draw on
+        :param frame: Frame to draw
+        :return: None
+        """
+        world = self.world
+        world.reset()
+        if frame.level_map is not None:
+            if frame.map_id != self._map_id:
+                self._map_id, self._map_renderer = frame.map_id, render_system(frame.level_map)
+            world.register_processor(self._map_renderer)
+        else:
+            world.register_processor(text_renderer)
+            world.register_processor(ascii_renderer)
+
+        for x, y, w, h, character in frame.sprites:
+            world.create_entity(Transform(position=Vector2(x, y)), Renderable(w=w, h=h, character=character))
+        for component in frame.texts + frame.ascii + frame.vision:
+            world.create_entity(component)
+
+        if _SCREENS[frame.screen].clear_on_tick:
+            echo(term.move_yx(0, 0))
+            echo(term.on_blue(term.clear))
+        world.tick(term, 0.0, '')
+
+
+def run_split(term: Terminal, seed: Optional[int], tick_interval: float = 1 / 10) -> SimulationStats:
+    """
+    Play the game with the simulation in a child process and the terminal in this one.
+
+    The simulation ticks at its own pace whatever the terminal keeps up with, this process only ever draws the
+    latest frame and skips any it was too slow for.
+
+    :param term: Terminal to play on
+    :param seed: Seed for the random number generator
+    :param tick_interval: Seconds between simulation ticks
+    :return: Statistics of the simulation
+    """
+    shm = shared_memory.SharedMemory(create=True, size=FRAME_BUFFER_SIZE)
+    conn, child_conn = Pipe()
+    process = Process(target=simulate, args=(shm.name, child_conn, seed, tick_interval), daemon=True)
+    process.start()
+    reader = FrameReader(shm.buf)
+    renderer = FrameRenderer()
+    try:
+        with term.hidden_cursor(), term.cbreak(), term.location():
+            while process.is_alive():
+                inp = term.inkey(timeout=tick_interval / 4)
+                if inp in (u'q', u'Q'):
+                    break
+                if inp:
+                    conn.send(str(inp))
+                frame = reader.read()
+                if frame is not None:
+                    renderer.draw(term, frame)
+        if process.is_alive():
+            conn.send(None)
+        stats = conn.recv() if conn.poll(5) else SimulationStats()
+        process.join()
+    finally:
+        shm.close()
+        shm.unlink()
+    return stats
@@ -1,47 +1,91 @@
-from typing import Generator, Optional, Union
+from typing import Generator, Iterator, List, Optional, Union
 
 from blessed import Terminal
 
+from game.chunkedmap import ChunkedMap
 from game.components import (
-    Ascii, FollowAI, Movement, PlayerInput, Renderable, Text, TimeToLive,
-    Transform
+    Ascii, FollowAI, PlayerInput, ReachedExit, Text, TimeToLive, Transform
 )
 from game.cutscenes import CutsceneFrame, CutsceneSequence, ordered_cutscenes
 from game.ecs.world import World
-from game.mapgeneration import MapType, mapgenerator
+from game.mapgeneration import MapReport, MapType, generate_level
+from game.prefabs import ENEMY, PLAYER
 from game.processors import (
-    ascii_renderer, enemy_movement, input_processor, movement_processor,
-    render_system, text_renderer, ttl_processor
+    ascii_renderer, enemy_movement, fov_processor, input_processor,
+    map_streaming_processor, movement_processor, render_system, text_renderer,
+    ttl_processor
 )
 from game.utils import Vector2, echo
 
+# Parameters every story level is generated with
+LEVEL_PARAMETERS = dict(
+    map_width=50,
+    map_height=50,
+    room_frequency=10,
+    room_size=30,
+    path_width=5
+)
+
+# Estimated bytes of level history kept for rewinding, and how far back a rewind goes
+REWIND_BUDGET = 1 << 18
+REWIND_SECONDS = 3.0
+REWIND_KEYS = (u'r', u'R')
+
+# Worlds of finished screens, reset and waiting to be reused by the next ones
+_world_pool: List[World] = []
+WORLD_POOL_SIZE = 4
+
 
 def _level_progression() -> Generator[Union['Cutscene', 'GameLevel'], None, None]:
     for cutscene in ordered_cutscenes:
-        yield Cutscene(cutscene)
-
-        next_map, spawn = mapgenerator(
-            map_width=50,
-            map_height=50,
-            room_frequency=10,
-            room_size=30,
-            path_width=5
-        )
-        yield GameLevel(next_map, spawn)
+        # Cutscenes consume their sequence, copy it so every progression gets the full story
+        yield Cutscene(list(cutscene))
+
+        next_map, spawn, report = generate_level(**LEVEL_PARAMETERS)
+        yield GameLevel(next_map, spawn, report)
     # TODO: Once we're out of levels, spawn a credits or some story ending
 
 
-# This generator outputs our level progression
-story_progression = _level_progression()
+def endless_progression(map_height: Optional[int] = None) -> Generator['GameLevel', None, None]:
+    """
+    Levels whose maps are generated while they are played, one after another.
+
+    :param map_height: Rows of every level, None for a single level that never ends
+    :return: Generator of levels
+    """
+    while True:
+        level_map = ChunkedMap(**dict(LEVEL_PARAMETERS, map_height=map_height))
+        yield GameLevel(level_map, level_map.spawn)
 
 
 class Screen(object):
     """Base class for all game screens"""
 
+    # Headless runs turn this off before setup so no render processors get registered
+    render: bool = True
+    # Runs without a player, which never press a rewind key, turn this off before setup so no journal is kept
+    rewind: bool = True
+    # Screens that track what is on the terminal themselves turn this off
+    clear_on_tick: bool = True
+
     def __init__(self, world: Optional[World] = None):
         if world is None:
-            world = World()
+            world = _world_pool.pop() if _world_pool else World()
         self.world = world
+        # Level progression of the session this screen belongs to, handed from screen to screen
+        self.progression: Optional[Iterator['Screen']] = None
+
+    def next_screen(self) -> Optional['Screen']:
+        """
+        Advance the level progression this screen belongs to.
+
+        :return: The next screen of the progression, None for a screen outside of a progression
+        """
+        if self.progression is None:
+            return None
+        screen = next(self.progression)
+        screen.progression = self.progression
+        return screen
 
     def setup(self, term: Terminal) -> None:
         """
@@ -52,20 +96,31 @@ class Screen(object):
         """
         pass
 
-    def tick(self, term: Terminal, dt: float, inp: str) -> Optional['Screen']:
+    def teardown(self) -> None:
+        """
+        Release the screen's world for reuse once the screen won't be ticked anymore.
+
+        :return: None
+        """
+        self.world.reset()
+        if len(_world_pool) < WORLD_POOL_SIZE:
+            _world_pool.append(self.world)
+
+    def tick(self, term: Optional[Terminal], dt: float, inp: str) -> Optional['Screen']:
         """
         Tick (update) the screen
 
-        :param term: Terminal reference
+        :param term: Terminal reference, None when not rendering
         :param dt: Delta between game loop iterations
         :param inp: Keyboard input
         :return: Optional next screen
         """
         # TODO: Globally before any processors run, blanking the screen makes some sense
         #       but it may not always be appropriate
-        color_bg = term.on_blue
-        echo(term.move_yx(0, 0))
-        echo(color_bg(term.clear))
+        if self.render and self.clear_on_tick:
+            color_bg = term.on_blue
+            echo(term.move_yx(0, 0))
+            echo(color_bg(term.clear))
         self.world.tick(term, dt, inp)
         return None
 
@@ -73,8 +128,10 @@ class Screen(object):
 class Intro(Screen):
     """Intro screen for the game"""
 
-    def __init__(self):
+    def __init__(self, progression: Optional[Iterator[Screen]] = None):
         super(Intro, self).__init__()
+        # Every Intro starts a new story unless it is given one to continue
+        self.progression = progression if progression is not None else _level_progression()
         self.text_entity: Optional[int] = None
         self.ttl_component: Optional[TimeToLive] = None
 
@@ -88,7 +145,8 @@ class Intro(Screen):
         text = Text(text_string='Dedicated Dugongs', v_align=Text.VerticalAlign.CENTER)
         self.ttl_component = TimeToLive(expires_after=1)
         self.text_entity = self.world.create_entity(text, self.ttl_component)
-        self.world.register_processor(text_renderer)
+        if self.render:
+            self.world.register_processor(text_renderer)
         self.world.register_processor(ttl_processor)
 
     def tick(self, term: Terminal, dt: float, inp: str) -> Optional['Screen']:
@@ -103,16 +161,21 @@ class Intro(Screen):
         # TODO: Blank the screen
         super(Intro, self).tick(term, dt, inp)
         if self.ttl_component.expired:
-            return next(story_progression)
+            return self.next_screen()
 
 
 class GameLevel(Screen):
     """Screen that plays out a game level"""
 
-    def __init__(self, level: MapType, spawn_location: int):
+    clear_on_tick = False
+
+    def __init__(self, level: Union[MapType, ChunkedMap], spawn_location: int, map_report: Optional[MapReport] = None):
         super(GameLevel, self).__init__()
         self.level = level
         self.spawn_location = spawn_location
+        # How the map was generated, None for maps that didn't come from generate_level
+        self.map_report = map_report
+        self.completed = False
 
     def setup(self, term: Terminal) -> None:
         """
@@ -123,24 +186,23 @@ class GameLevel(Screen):
         """
         self.world.register_processor(input_processor)
 
-        player_transform = Transform(position=Vector2(x=self.spawn_location))
-        self.world.create_entity(
-            player_transform,
-            Movement(direction=Vector2.RIGHT),
-            PlayerInput(),
-            Renderable(w=1, h=1, character=u'^')
-        )
-
-        self.world.create_entity(
-            Transform(position=Vector2(x=self.spawn_location + 2)),
-            Movement(direction=Vector2.RIGHT),
-            FollowAI(follow_transform=player_transform),
-            Renderable(w=1, h=1, character=u'O')
-        )
+        player, = self.world.spawn_batch(PLAYER, 1, overrides={
+            Transform: {'position': Vector2(x=self.spawn_location)},
+        })
+        self.world.spawn_batch(ENEMY, 1, overrides={
+            Transform: {'position': Vector2(x=self.spawn_location + 2)},
+            FollowAI: {'follow_transform': self.world.get_component(player, Transform)},
+        })
 
         self.world.register_processor(enemy_movement(self.level))
         self.world.register_processor(movement_processor(self.level))
-        self.world.register_processor(render_system(self.level))
+        self.world.register_processor(fov_processor(self.level))
+        if isinstance(self.level, ChunkedMap):
+            self.world.register_processor(map_streaming_processor(self.level))
+        if self.render:
+            self.world.register_processor(render_system(self.level))
+        if self.rewind:
+            self.world.enable_journal(REWIND_BUDGET)
 
     def tick(self, term: Terminal, dt: float, inp: str) -> Optional['Screen']:
         """
@@ -151,11 +213,15 @@ class GameLevel(Screen):
         :param inp: Keyboard input
         :return: Optional next screen
         """
-        try:
-            super(GameLevel, self).tick(term, dt, inp)
-        except IndexError:
-            next_screen = next(story_progression)
-            return next_screen
+        if inp in REWIND_KEYS and self.world.journal is not None:
+            self.world.rewind(self.world.journal.ticks_within(REWIND_SECONDS))
+            # Redraw the rewound level without advancing its clock
+            dt, inp = 0.0, ''
+        super(GameLevel, self).tick(term, dt, inp)
+        for reached in self.world.view(ReachedExit):
+            if self.world.get_component(reached.entity, PlayerInput) is not None:
+                self.completed = True
+                return self.next_screen()
 
 
 class Cutscene(Screen):
@@ -202,9 +268,10 @@ class Cutscene(Screen):
             self.text
         )
 
-        self.world.register_processor(text_renderer)
         self.world.register_processor(ttl_processor)
-        self.world.register_processor(ascii_renderer)
+        if self.render:
+            self.world.register_processor(text_renderer)
+            self.world.register_processor(ascii_renderer)
 
     def tick(self, term: Terminal, dt: float, inp: str) -> Optional['Screen']:
         """
@@ -219,8 +286,7 @@ class Cutscene(Screen):
         if self.art_ttl.expired:
             scene = self._next_scene()
             if scene is None:
-                next_screen = next(story_progression)
-                return next_screen
+                return self.next_screen()
 
             # Switch out the frame data on the components
             art, timing, text = scene
@@ -1,10 +1,14 @@
+import contextlib
 import dataclasses
 import math
-from functools import partial
-from typing import ClassVar, Tuple, Union
+from contextvars import ContextVar
+from typing import ClassVar, Iterator, Optional, TextIO, Tuple, Union
 
 Numeric = Union[int, float]
 
+# Stream echo writes to, None meaning sys.stdout. A context variable keeps concurrent sessions apart.
+_output_stream: ContextVar[Optional[TextIO]] = ContextVar('output_stream', default=None)
+
 
 @dataclasses.dataclass
 class Vector2(object):
@@ -84,4 +88,43 @@ Vector2.UP = Vector2(0, -1)
 Vector2.DOWN = Vector2(0, 1)
 Vector2.LEFT = Vector2(-1, 0)
 Vector2.RIGHT = Vector2(1, 0)
-echo = partial(print, end='', flush=True)
+
+
+def echo(*values: object) -> None:
+    """
+    Write values to the current output stream without a trailing newline.
+
+    :param values: Values to write
+    :return: None
+    """
+    print(*values, end='', flush=True, file=_output_stream.get())
+
+
+@contextlib.contextmanager
+def output_to(stream: TextIO) -> Iterator[None]:
+    """
+    Redirect echo to another stream for the duration of the context.
+
+    :param stream: Stream to write to
+    :return: Context manager
+    """
+    token = _output_stream.set(stream)
+    try:
+        yield
+    finally:
+        _output_stream.reset(token)
+
+
+# Private OSC sequence marking the end of a frame, terminals ignore OSC sequences they don't know
+FRAME_MARKER_PREFIX = '\x1b]7777;'
+FRAME_MARKER_SUFFIX = '\x07'
+
+
+def frame_marker(screen_name: str) -> str:
+    """
+    Build the escape sequence that marks the end of a frame in an output stream.
+
+    :param screen_name: Name of the screen that rendered the frame
+    :return: Escape sequence
+    """
+    return f'{FRAME_MARKER_PREFIX}{screen_name}{FRAME_MARKER_SUFFIX}'
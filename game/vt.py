@@ -0,0 +1,180 @@
+import re
+from typing import Callable, Dict, List, Optional, Set, Tuple
+
+Position = Tuple[int, int]
+# A character and the SGR parameters it was drawn with
+Cell = Tuple[str, str]
+
+_TOKEN = re.compile(
+    r'\x1b\[(?P<csi_params>[0-9;?>]*)[ -/]*(?P<csi_final>[@-~])'  # Control sequences
+    r'|\x1b\](?P<osc>[^\x07\x1b]*)(?:\x07|\x1b\\)'  # Operating system commands, terminated by BEL or ST
+    r'|\x1b[()*+][0-9A-Za-z]'  # Character set designation
+    r'|\x1b(?P<esc>[0-9A-Za-z=>])'  # Other two byte escapes
+    r'|(?P<text>[^\x00-\x1f\x1b\x7f]+)'
+    r'|(?P<control>[\x00-\x1f\x7f])'
+)
+
+BLANK_CELL: Cell = (u' ', '')
+
+
+class VirtualTerminal(object):
+    """
+    Screen model for the subset of xterm output the game produces.
+
+    Understands cursor positioning and movement, erasing, SGR attributes, saving and restoring the cursor and
+    operating system commands. Everything else is consumed and ignored. Data may be fed in arbitrary chunks,
+    an escape sequence split between two chunks is completed by the next one.
+    """
+
+    def __init__(self, width: int = 80, height: int = 24, on_osc: Optional[Callable[[str], None]] = None):
+        # Terminals without a size, like a fresh pseudo-terminal, report 0 by 0
+        self.width = max(width, 1)
+        self.height = max(height, 1)
+        self.on_osc = on_osc
+        self.cells: List[List[Cell]] = [[BLANK_CELL] * self.width for _ in range(self.height)]
+        self.x = 0
+        self.y = 0
+        self.attrs = ''
+        # Content of the cells written since the last call to take_dirty, from before they were written
+        self._before: Dict[Position, Cell] = {}
+        self._saved: Tuple[int, int, str] = (0, 0, '')
+        self._pending = ''
+
+    @property
+    def display(self) -> List[str]:
+        """The characters on screen, one string per row"""
+        return [''.join(character for character, _ in row) for row in self.cells]
+
+    def take_dirty(self) -> Set[Position]:
+        """
+        Collect the cells that differ from what they were on the last call.
+
+        Cells that were overwritten with what they held before, like a cleared and redrawn screen, do not count.
+
+        :return: Positions of the changed cells
+        """
+        dirty = {(x, y) for (x, y), cell in self._before.items() if self.cells[y][x] != cell}
+        self._before = {}
+        return dirty
+
+    def feed(self, data: str) -> None:
+        """
+        Apply terminal output to the screen.
+
+        :param data: Decoded output, may end in the middle of an escape sequence
+        :return: None
+        """
+        data = self._pending + data
+        self._pending = ''
+        pos = 0
+        while pos < len(data):
+            match = _TOKEN.match(data, pos)
+            if match is None:
+                if data[pos] == '\x1b' and len(data) - pos < 64 and '\x07' not in data[pos:]:
+                    # Incomplete sequence, wait for the rest of it
+                    self._pending = data[pos:]
+                    return
+                # Unknown escape, skip the escape character and carry on with the rest as text
+                pos += 1
+                continue
+            pos = match.end()
+
+            if match.group('text') is not None:
+                self._write(match.group('text'))
+            elif match.group('csi_final') is not None:
+                self._csi(match.group('csi_params'), match.group('csi_final'))
+            elif match.group('control') is not None:
+                self._control(match.group('control'))
+            elif match.group('osc') is not None:
+                if self.on_osc is not None:
+                    self.on_osc(match.group('osc'))
+            elif match.group('esc') == '7':
+                self._saved = (self.x, self.y, self.attrs)
+            elif match.group('esc') == '8':
+                self.x, self.y, self.attrs = self._saved
+
+    def _set(self, x: int, y: int, cell: Cell) -> None:
+        if self.cells[y][x] != cell:
+            self._before.setdefault((x, y), self.cells[y][x])
+            self.cells[y][x] = cell
+
+    def _write(self, text: str) -> None:
+        for character in text:
+            if self.x >= self.width:
+                # Deferred auto wrap, like xterm the cursor stays on the last column until more text follows
+                self.x = 0
+                self._line_feed()
+            self._set(self.x, self.y, (character, self.attrs))
+            self.x += 1
+
+    def _line_feed(self) -> None:
+        if self.y + 1 < self.height:
+            self.y += 1
+            return
+        for y in range(self.height):
+            for x in range(self.width):
+                self._before.setdefault((x, y), self.cells[y][x])
+        self.cells.pop(0)
+        self.cells.append([(u' ', self.attrs)] * self.width)
+
+    def _control(self, character: str) -> None:
+        if character == '\r':
+            self.x = 0
+        elif character == '\n':
+            self._line_feed()
+        elif character == '\b':
+            self.x = max(0, min(self.x, self.width - 1) - 1)
+        elif character == '\t':
+            self.x = min(self.width - 1, (self.x // 8 + 1) * 8)
+
+    def _erase(self, positions: List[Position]) -> None:
+        blank = (u' ', self.attrs)
+        for x, y in positions:
+            self._set(x, y, blank)
+
+    def _csi(self, params: str, final: str) -> None:
+        if params.startswith(('?', '>')):
+            # Private modes, like hiding the cursor, do not affect the screen contents
+            return
+        args = [int(arg) if arg else 0 for arg in params.split(';')] if params else []
+        first = args[0] if args else 0
+        step = max(first, 1)
+
+        if final in 'Hf':
+            row = args[0] if args else 1
+            column = args[1] if len(args) > 1 else 1
+            self.y = min(max(row, 1), self.height) - 1
+            self.x = min(max(column, 1), self.width) - 1
+        elif final == 'A':
+            self.y = max(0, self.y - step)
+        elif final == 'B':
+            self.y = min(self.height - 1, self.y + step)
+        elif final == 'C':
+            self.x = min(self.width - 1, self.x + step)
+        elif final == 'D':
+            self.x = max(0, min(self.x, self.width - 1) - step)
+        elif final == 'G':
+            self.x = min(step, self.width) - 1
+        elif final == 'd':
+            self.y = min(step, self.height) - 1
+        elif final == 'J':
+            x, y = min(self.x, self.width - 1), self.y
+            if first == 0:
+                self._erase([(cx, y) for cx in range(x, self.width)])
+                self._erase([(cx, cy) for cy in range(y + 1, self.height) for cx in range(self.width)])
+            elif first == 1:
+                self._erase([(cx, cy) for cy in range(y) for cx in range(self.width)])
+                self._erase([(cx, y) for cx in range(x + 1)])
+            else:
+                self._erase([(cx, cy) for cy in range(self.height) for cx in range(self.width)])
+        elif final == 'K':
+            x, y = min(self.x, self.width - 1), self.y
+            columns = {0: range(x, self.width), 1: range(x + 1)}.get(first, range(self.width))
+            self._erase([(cx, y) for cx in columns])
+        elif final == 'm':
+            if not args or args == [0]:
+                self.attrs = ''
+            elif args[0] == 0:
+                self.attrs = params.partition(';')[2]
+            else:
+                self.attrs = f'{self.attrs};{params}' if self.attrs else params